@@ -0,0 +1,80 @@
+'''
+Persistent connections for the per-app database aliases.
+Every dynamic alias keeps its connection open between requests (CONN_MAX_AGE), so a request does not pay the TCP
+and authentication setup to MySQL. Once a request is finished, the connections of this worker which stayed idle for
+longer than DYNAMIC_DB_IDLE_TIMEOUT are closed, then the least recently used ones beyond DYNAMIC_DB_MAX_CONNECTIONS.
+'''
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.core.signals import request_finished
+# thread safe bookkeeping
+import threading
+import time
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+from RESTful_Face_Web import settings
+
+_last_used = {}  # alias -> monotonic time of the last use
+_lock = threading.Lock()
+
+
+def configure(alias):
+    '''
+    Make the connections of a registered dynamic alias persistent.
+    '''
+    settings.DATABASES[alias].setdefault('CONN_MAX_AGE', settings.DYNAMIC_DB_CONN_MAX_AGE)
+
+
+def touch(alias):
+    '''
+    Record the use of an alias, called when a request resolves its app (the alias is app_database(appID), not the appID).
+    '''
+    with _lock:
+        _last_used[alias] = time.monotonic()
+
+
+def open_aliases():
+    '''
+    :return: the dynamic aliases with an open connection in this thread, the least recently used first
+    '''
+    with _lock:
+        aliases = sorted(_last_used, key=_last_used.get)
+    # an open alias is already loaded, dict.__contains__ does not look the registry up (runtime_db/registry.py)
+    return [alias for alias in aliases if dict.__contains__(connections.databases, alias) and connections[alias].connection is not None]
+
+
+def evict(now=None):
+    '''
+    Close the idle connections, then the least recently used ones beyond the cap.
+    :return: the closed aliases
+    '''
+    now = time.monotonic() if now is None else now
+    aliases = open_aliases()
+
+    closed = [alias for alias in aliases if now - _last_used.get(alias, now) > settings.DYNAMIC_DB_IDLE_TIMEOUT]
+    remaining = [alias for alias in aliases if alias not in closed]
+    closed += remaining[:max(0, len(remaining) - settings.DYNAMIC_DB_MAX_CONNECTIONS)]
+
+    for alias in closed:
+        connections[alias].close()
+        with _lock:
+            _last_used.pop(alias, None)
+    if len(closed) != 0:
+        log.info('Closed the connections of %d app databases.' % (len(closed)))
+    return closed
+
+
+def _on_connection_created(sender, connection, **kwargs):
+    if connection.alias != 'default':
+        touch(connection.alias)
+
+
+def _on_request_finished(sender, **kwargs):
+    evict()
+
+
+connection_created.connect(_on_connection_created)
+request_finished.connect(_on_request_finished)
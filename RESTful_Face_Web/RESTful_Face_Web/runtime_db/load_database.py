@@ -1,13 +1,18 @@
 from django.db import connections
 import os
-from RESTful_Face_Web.settings import DB_SETTINGS_BASE_DIR
+from RESTful_Face_Web.settings import DB_SETTINGS_BASE_DIR, DB_REGISTRY_FILE
+from RESTful_Face_Web.runtime_db import connection_pool
 
-for filename in os.listdir(DB_SETTINGS_BASE_DIR):
-    if 'dbconf' not in filename:
-        continue
-    path = os.path.join(DB_SETTINGS_BASE_DIR, filename)
-    f = open(path)
-    db_settings = f.read()
-    f.close()
-    from RESTful_Face_Web import settings
-    exec(db_settings)
\ No newline at end of file
+# the app databases are registered on first use from the registry (see registry.py),
+# the .dbconf files are only executed for the deployments not converted yet (manage.py convert_dbconf_registry)
+if not os.path.exists(DB_REGISTRY_FILE):
+    for filename in os.listdir(DB_SETTINGS_BASE_DIR):
+        if 'dbconf' not in filename:
+            continue
+        path = os.path.join(DB_SETTINGS_BASE_DIR, filename)
+        f = open(path)
+        db_settings = f.read()
+        f.close()
+        from RESTful_Face_Web import settings
+        exec(db_settings)
+        connection_pool.configure(filename.replace('.dbconf', ''))
@@ -0,0 +1,98 @@
+'''
+Registry of the per-app database settings: one JSON file {alias: settings} instead of a .dbconf snippet per app.
+settings.DATABASES is a LazyDatabases, an app's alias is only added to it the first time the app is used, so the
+start of a worker does not depend on the number of apps. The file is read again only when it has changed, e.g. when
+another worker created an app.
+'''
+
+import json
+import os
+import threading
+import fcntl
+from contextlib import contextmanager
+
+
+class LazyDatabases(dict):
+    def __init__(self, databases, registry_file, defaults=None):
+        '''
+        :param databases: the statically configured aliases, e.g. 'default'
+        :param registry_file: the JSON registry of the app aliases
+        :param defaults: settings added to every alias loaded from the registry, e.g. CONN_MAX_AGE
+        '''
+        super().__init__(databases)
+        self.registry_file = registry_file
+        self.defaults = defaults or {}
+        self._registry = {}
+        self._registry_mtime = None
+        self._lock = threading.Lock()
+
+    def __missing__(self, alias):
+        database = self.lookup(alias)
+        if database is None:
+            raise KeyError(alias)
+        return database
+
+    def __contains__(self, alias):
+        return super().__contains__(alias) or self.lookup(alias) is not None
+
+    def lookup(self, alias):
+        '''
+        Add the alias from the registry.
+        :return: its settings, or None if it is not registered
+        '''
+        with self._lock:
+            if super().__contains__(alias):
+                return super().__getitem__(alias)
+
+            database = self._read_registry().get(alias)
+            if database is None:
+                return None
+            database = dict(self.defaults, **database)
+            self[alias] = database
+            return database
+
+    def _read_registry(self):
+        try:
+            mtime = os.stat(self.registry_file).st_mtime_ns
+        except OSError:
+            return {}
+        if mtime != self._registry_mtime:
+            with open(self.registry_file) as f:
+                self._registry = json.load(f)
+            self._registry_mtime = mtime
+        return self._registry
+
+
+@contextmanager
+def _locked(registry_file):
+    # the workers of all processes write the same file
+    with open(registry_file + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def read_registry(registry_file):
+    if not os.path.exists(registry_file):
+        return {}
+    with open(registry_file) as f:
+        return json.load(f)
+
+
+def update_registry(registry_file, add=None, remove=None):
+    '''
+    :param add: {alias: settings} to register
+    :param remove: aliases to unregister
+    '''
+    with _locked(registry_file):
+        registry = read_registry(registry_file)
+        registry.update(add or {})
+        for alias in remove or []:
+            registry.pop(alias, None)
+
+        tmp_file = registry_file + '.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(registry, f, indent=1, sort_keys=True)
+        os.replace(tmp_file, registry_file)
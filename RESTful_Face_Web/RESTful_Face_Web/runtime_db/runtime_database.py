@@ -1,6 +1,4 @@
 # retrieve project path settings
-# database connections
-from django.db import connections
 # system operation
 import os
 # logging
@@ -10,6 +8,7 @@ log = logging.getLogger(__name__)
 from abc import ABCMeta, abstractmethod
 
 from RESTful_Face_Web import settings
+from RESTful_Face_Web.runtime_db.registry import update_registry
 
 # database manager to create on the fly and initialize it !
 # https://stackoverflow.com/questions/6585373/django-multiple-and-dynamic-databases
@@ -37,12 +36,10 @@ class SQLiteManager(BaseDBManager):
         filename = os.path.join(settings.BASE_DIR, 'db_'+name+'.sqlite3')
 
         # tell Django there is a new database
-        setting_str = '''settings.DATABASES['%s'] = {
-    'ENGINE': 'django.db.backends.sqlite3',
-    'NAME': '%s',
-}'''% (name, filename)
-        exec(setting_str)
-        save_db_settings_to_file(setting_str, name)
+        register_database(name, {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': filename,
+        })
 
         # create database file
         file = open(filename, 'w+')
@@ -61,17 +58,14 @@ class SQLiteManager(BaseDBManager):
         log.info("Created sqlite database %s and initialize a table '%s'!"%(db_name, table_name))
 
     def drop_database(self, name):
+        unregister_database(name)
         try:
-            connections.databases.pop(name)
-            os.remove(os.path.join(settings.DB_SETTINGS_BASE_DIR, name + '.dbconf'))
             os.remove(os.path.join(settings.BASE_DIR, 'db_' + name + '.sqlite3'))
             log.info("Database %s is moved!" % (name))
 
         except FileNotFoundError:
             log.warning("DB %s has already been moved!" % (name))
             log.error(traceback.format_exc())
-        except KeyError:
-            log.warning("Database %s is not in use!"% (name))
 
 class MySQLManager(BaseDBManager):
 
@@ -81,16 +75,15 @@ class MySQLManager(BaseDBManager):
         name = str(name)
 
         # tell Django there is a new mysql database
-        setting_str = '''settings.DATABASES['%s'] = {
-    'ENGINE': 'django.db.backends.mysql',
-    'USER': '%s',
-    'PASSWORD': '%s',
-    'NAME': 'company%s',
-    'HOST': '%s',
-    'PORT': '3306' ,
-}'''% (name, settings.MYSQL_USER, settings.MYSQL_PASSWORD, name, settings.MYSQL_HOST)
-        exec(setting_str)
-        save_db_settings_to_file(setting_str, name)
+        register_database(name, {
+            'ENGINE': 'django.db.backends.mysql',
+            'USER': settings.MYSQL_USER,
+            'PASSWORD': settings.MYSQL_PASSWORD,
+            'NAME': 'company%s' % (name),
+            'HOST': settings.MYSQL_HOST,
+            'PORT': '3306',
+            'CONN_MAX_AGE': settings.DYNAMIC_DB_CONN_MAX_AGE,
+        })
 
         # create database
         import pymysql
@@ -116,16 +109,8 @@ class MySQLManager(BaseDBManager):
     def drop_database(self, name):
         from RESTful_Face_Web import settings
         print("dropping database, ", name)
-        # delete setting files
-        try:
-            connections.databases.pop(name)
-            os.remove(os.path.join(settings.DB_SETTINGS_BASE_DIR, name + '.dbconf'))
-            log.info("DB setting file %s.dbconf is moved!" % (name))
-        except FileNotFoundError:
-            log.warning("DB setting file %s.dbconf has already been moved!" % (name))
-            log.error(traceback.format_exc())
-        except KeyError:
-            log.warning('Database %s is not in use!' % (name))
+        # delete the settings
+        unregister_database(name)
 
         # delete database
         import pymysql
@@ -136,6 +121,51 @@ class MySQLManager(BaseDBManager):
         conn.close()
         log.info("Database company%s has been dropped !" % (name))
 
+class SharedSchemaManager(BaseDBManager):
+    '''
+    All the apps share the tables of settings.SHARED_TENANT_DATABASE, their rows are told apart by appID.
+    The tables are created once by manage.py migrate_to_shared_schema --create-tables.
+    '''
+
+    def create_database(self, name):
+        log.info("App %s uses the shared database %s." % (name, settings.SHARED_TENANT_DATABASE))
+
+    def create_table(self, db_name, Model, table_name):
+        pass
+
+    def drop_database(self, name):
+        from company.models import Subject, ClassifierModel
+        # faces, features and templates are deleted with their subjects
+        Subject.objects.for_app(name).delete()
+        ClassifierModel.objects.for_app(name).delete()
+        log.info("Rows of app %s deleted from the shared database!" % (name))
+
+def uses_dbconf():
+    '''
+    :return: whether the app databases are still registered by .dbconf files, i.e. not converted to the registry yet
+    '''
+    return not os.path.exists(settings.DB_REGISTRY_FILE) and \
+        any('dbconf' in filename for filename in os.listdir(settings.DB_SETTINGS_BASE_DIR))
+
+def register_database(name, database):
+    settings.DATABASES[name] = database
+    if uses_dbconf():
+        save_db_settings_to_file("settings.DATABASES['%s'] = %s" % (name, repr(database)), name)
+    else:
+        update_registry(settings.DB_REGISTRY_FILE, add={name: database})
+        log.info('Database %s registered!' % (name))
+
+def unregister_database(name):
+    if settings.DATABASES.pop(name, None) is None:
+        log.warning('Database %s is not in use!' % (name))
+    if os.path.exists(settings.DB_REGISTRY_FILE):
+        update_registry(settings.DB_REGISTRY_FILE, remove=[name])
+    try:
+        os.remove(os.path.join(settings.DB_SETTINGS_BASE_DIR, name + '.dbconf'))
+        log.info("DB setting file %s.dbconf is moved!" % (name))
+    except FileNotFoundError:
+        pass
+
 def save_db_settings_to_file(setting_str, name):
     from RESTful_Face_Web import settings
     filename = os.path.join(settings.DB_SETTINGS_BASE_DIR, name+'.dbconf')
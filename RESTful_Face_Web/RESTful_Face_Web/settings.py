@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.11/ref/settings/
 """
 
 import os, datetime
+from RESTful_Face_Web.runtime_db.registry import LazyDatabases
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -84,7 +85,17 @@ MYSQL_USER = 'RESTful_Face_API'
 MYSQL_PASSWORD = 'jt1330'
 MYSQL_HOST = 'localhost'
 DB_SETTINGS_BASE_DIR = os.path.join(BASE_DIR, 'RESTful_Face_Web/runtime_db/database_settings')
-DATABASES = {
+# the app databases, registered on first use (see runtime_db/registry.py, manage.py convert_dbconf_registry)
+DB_REGISTRY_FILE = os.path.join(DB_SETTINGS_BASE_DIR, 'registry.json')
+# 'database': every app has its own database, registered by a .dbconf file
+# 'shared': all apps share the tables of SHARED_TENANT_DATABASE (see manage.py migrate_to_shared_schema)
+TENANT_MODE = 'database'
+SHARED_TENANT_DATABASE = 'tenants'
+# persistent connections of the per-app databases (see runtime_db/connection_pool.py), per worker process
+DYNAMIC_DB_CONN_MAX_AGE = 600 # seconds a connection is reused, None for unlimited
+DYNAMIC_DB_IDLE_TIMEOUT = 300 # seconds without use before a connection is closed
+DYNAMIC_DB_MAX_CONNECTIONS = 32 # open app connections kept at most
+DATABASES = LazyDatabases({
     'default': {
         'ENGINE': 'django.db.backends.mysql',
         'USER': 'RESTful_Face_API',
@@ -92,13 +103,24 @@ DATABASES = {
         'NAME': 'Admin',
         'HOST': 'localhost',
         'PORT': '3306',
+        'CONN_MAX_AGE': 600,
+    },
+    # the apps' data in the shared tenant mode
+    'tenants': {
+        'ENGINE': 'django.db.backends.mysql',
+        'USER': 'RESTful_Face_API',
+        'PASSWORD': 'jt1330',
+        'NAME': 'Tenants',
+        'HOST': 'localhost',
+        'PORT': '3306',
+        'CONN_MAX_AGE': 600,
     },
     #'default': {
     #    'ENGINE': 'django.db.backends.sqlite3',
     #    'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
     #s}
 
-}
+}, registry_file=DB_REGISTRY_FILE, defaults={'CONN_MAX_AGE': DYNAMIC_DB_CONN_MAX_AGE})
 
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 # Password validation
@@ -14,3 +14,13 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "RESTful_Face_Web.settings")
 
 application = get_wsgi_application()
+
+# load the face models in every worker right after uwsgi forks it, instead of on its first request
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    postfork = None
+
+if postfork is not None:
+    from service import model_registry
+    postfork(model_registry.warm_up)
@@ -0,0 +1,209 @@
+'''
+Upload many faces at once from a zip or tar archive and a manifest mapping every image of the archive to its subject.
+The images are streamed out of the archive and handled in chunks: the files of a chunk are written, then its Face
+(and Feature) rows are inserted with bulk_create inside one transaction. The result reports every item.
+
+Manifest: a JSON object {"path in archive": "subjectID"}, or CSV lines "path in archive,subjectID". It is either the
+'manifest' field of the request or the manifest.json / manifest.csv member of the archive.
+'''
+
+# models
+from .models import Subject, Face, Feature, app_database, insert_features
+from django.db import transaction
+from django.core.files.base import ContentFile
+from django.utils import timezone
+# service
+from service import settings as service_settings
+from service import model_registry
+from service.image_ingest import decode_image, ImageError
+from service.feature_extraction import enabled_features
+# archives
+import zipfile
+import tarfile
+import json
+import csv
+import io
+import os
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+MANIFEST_NAMES = ['manifest.json', 'manifest.csv']
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def parse_manifest(text):
+    '''
+    :return: {path in archive: subjectID}
+    '''
+    text = text.strip()
+    if text.startswith('{'):
+        try:
+            return dict((str(name), str(subjectID)) for name, subjectID in json.loads(text).items())
+        except ValueError:
+            raise ManifestError('Manifest is not valid JSON.')
+    manifest = {}
+    for row in csv.reader(io.StringIO(text)):
+        if len(row) == 0:
+            continue
+        if len(row) != 2:
+            raise ManifestError('Manifest CSV rows must be "path,subjectID".')
+        manifest[row[0].strip()] = row[1].strip()
+    return manifest
+
+
+def iterate_archive(upload, max_size=None):
+    '''
+    :param max_size: the members larger than this (bytes) are not read, settings.bulk_upload_max_file_size by default
+    :return: generator of (member name, bytes or None if too large), the manifest members are skipped
+    '''
+    max_size = service_settings.bulk_upload_max_file_size if max_size is None else max_size
+    upload.seek(0)
+    if zipfile.is_zipfile(upload):
+        upload.seek(0)
+        with zipfile.ZipFile(upload) as archive:
+            for info in archive.infolist():
+                if not info.filename.endswith('/') and info.filename not in MANIFEST_NAMES:
+                    # the size of the zip directory, zipfile does not read more than it
+                    yield info.filename, archive.read(info) if info.file_size <= max_size else None
+        return
+
+    upload.seek(0)
+    try:
+        archive = tarfile.open(fileobj=upload, mode='r|*')
+    except tarfile.TarError:
+        raise ManifestError('The archive should be a zip or a tar file.')
+    with archive:
+        for member in archive:
+            if member.isfile() and member.name not in MANIFEST_NAMES:
+                yield member.name, archive.extractfile(member).read() if member.size <= max_size else None
+
+
+def read_archive_manifest(upload):
+    max_size = service_settings.bulk_upload_max_file_size
+    upload.seek(0)
+    if zipfile.is_zipfile(upload):
+        upload.seek(0)
+        with zipfile.ZipFile(upload) as archive:
+            for name in MANIFEST_NAMES:
+                if name in archive.namelist():
+                    if archive.getinfo(name).file_size > max_size:
+                        raise ManifestError('Manifest is too large. At most %d bytes.' % (max_size))
+                    return archive.read(name).decode('utf-8')
+        return None
+
+    upload.seek(0)
+    try:
+        archive = tarfile.open(fileobj=upload, mode='r|*')
+    except tarfile.TarError:
+        raise ManifestError('The archive should be a zip or a tar file.')
+    with archive:
+        for member in archive:
+            if member.name in MANIFEST_NAMES:
+                if member.size > max_size:
+                    raise ManifestError('Manifest is too large. At most %d bytes.' % (max_size))
+                return archive.extractfile(member).read().decode('utf-8')
+    return None
+
+
+class BulkFaceUpload:
+    def __init__(self, app, chunk_size=None):
+        self.app = app
+        self.chunk_size = service_settings.bulk_upload_chunk_size if chunk_size is None else chunk_size
+
+    def run(self, upload, manifest):
+        '''
+        :param upload: the zip or tar file
+        :param manifest: {path in archive: subjectID}
+        :return: list of per item reports {'file', 'subjectID', 'imageID' or 'error'}
+        '''
+        subjects = dict((subject.subjectID, subject) for subject in
+                        Subject.objects.for_app(self.app.appID).filter(subjectID__in=set(manifest.values())))
+
+        reports = []
+        chunk = []
+        for name, content in iterate_archive(upload):
+            report = {'file': name, 'subjectID': manifest.get(name)}
+            reports.append(report)
+            if report['subjectID'] is None:
+                report['error'] = 'Not in the manifest.'
+                continue
+            if report['subjectID'] not in subjects:
+                report['error'] = 'Subject not found.'
+                continue
+            if os.path.basename(name) in ['', '.', '..']:
+                report['error'] = 'Invalid file name.'
+                continue
+            if content is None:
+                report['error'] = 'File is too large. At most %d bytes.' % (service_settings.bulk_upload_max_file_size)
+                continue
+            try:
+                face_array = decode_image(io.BytesIO(content))
+            except ImageError as e:
+                report['error'] = str(e)
+                continue
+            if not (tuple(face_array.shape[1::-1]) == tuple(service_settings.face_size)):
+                report['error'] = 'Face image has a wrong size' + str(face_array.shape[1::-1]) + '. It should be ' + str(service_settings.face_size) + '.'
+                continue
+
+            # the decoded face is only kept for the synchronous extraction
+            if service_settings.async_feature_extraction:
+                face_array = None
+            chunk.append((report, subjects[report['subjectID']], content, face_array))
+            if len(chunk) == self.chunk_size:
+                self._save_chunk(chunk)
+                chunk = []
+        if len(chunk) != 0:
+            self._save_chunk(chunk)
+
+        for name in set(manifest.keys()) - set(report['file'] for report in reports):
+            reports.append({'file': name, 'subjectID': manifest[name], 'error': 'Not in the archive.'})
+        return reports
+
+    def _save_chunk(self, chunk):
+        appID = self.app.appID
+
+        faces = []
+        try:
+            # write the files first, the storage picks unique names
+            for report, subject, content, face_array in chunk:
+                face = Face(subject=subject)
+                face.image.save(os.path.basename(report['file']), ContentFile(content), save=False)
+                faces.append(face)
+
+            with transaction.atomic(using=app_database(appID)):
+                Face.objects.for_app(appID).bulk_create(faces)
+                # mysql does not return the ids of the inserted rows
+                ids = dict(Face.objects.for_app(appID).filter(image__in=[face.image.name for face in faces]).values_list('image', 'id'))
+                for face in faces:
+                    face.id = ids[face.image.name]
+
+                if not service_settings.async_feature_extraction:
+                    extractor = model_registry.get_extractor()
+                    face_arrays = [face_array for report, subject, content, face_array in chunk]
+                    features = []
+                    for feature_name in enabled_features(self.app):
+                        feature_data = extractor.extract_batch(face_arrays, feature_name).real
+                        features.extend(Feature(face=face, feature_name=feature_name, data=data.reshape([-1, 1])) for face, data in zip(faces, feature_data))
+                    insert_features(appID, features)
+
+                # update the subjects' modified_time, so their templates are updated by the enrollment
+                Subject.objects.for_app(appID).filter(id__in=set(face.subject_id for face in faces)).update(modified_time=timezone.now())
+        except Exception as e:
+            log.exception('App %s: bulk upload of %d faces failed.' % (appID, len(chunk)))
+            # the files written so far
+            for face in faces:
+                try:
+                    face.image.delete(save=False)
+                except Exception:
+                    log.exception('App %s: %s not deleted.' % (appID, face.image.name))
+            for report, subject, content, face_array in chunk:
+                report['error'] = 'Upload failed: %s' % (str(e))
+            return
+
+        for face, (report, subject, content, face_array) in zip(faces, chunk):
+            report['imageID'] = face.id
+        log.info('App %s: %d faces uploaded.' % (appID, len(faces)))
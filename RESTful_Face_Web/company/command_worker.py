@@ -0,0 +1,102 @@
+'''
+Runs the queued commands (see COMMAND_QUEUED) out of the request path, e.g. /commands/enroll/.
+A worker claims a command with a conditional update from queued to running, so several workers can poll the same
+table without running a command twice. A running command whose worker died is failed after settings.command_timeout
+without progress, and the commands of deleted apps are failed instead of being run.
+'''
+
+# models
+from .models import Command, SERVICES, app_database, COMMAND_QUEUED, COMMAND_RUNNING, COMMAND_DONE, COMMAND_FAILED
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+from service import settings as service_settings
+from RESTful_Face_Web.runtime_db import connection_pool
+import datetime
+import json
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+# the results column holds at most 1024 characters
+MAX_RESULTS_LENGTH = 1024
+
+
+def encode_results(results):
+    '''
+    :return: the JSON of the results, the largest fields are dropped (and listed in 'dropped') until it fits in the
+        results column, so it can still be parsed
+    '''
+    text = json.dumps(results, cls=DjangoJSONEncoder)
+    if len(text) <= MAX_RESULTS_LENGTH:
+        return text
+
+    results = dict(results) if isinstance(results, dict) else {'results': results}
+    sizes = dict((key, len(json.dumps(value, cls=DjangoJSONEncoder))) for key, value in results.items())
+    dropped = []
+    for key in sorted(sizes, key=sizes.get, reverse=True):
+        del results[key]
+        dropped.append(key)
+        text = json.dumps(dict(results, dropped=dropped), cls=DjangoJSONEncoder)
+        if len(text) <= MAX_RESULTS_LENGTH:
+            return text
+    return json.dumps({'info': 'The results are too large to be stored.'})
+
+
+def fail_stale():
+    '''
+    Fail the running commands without progress for settings.command_timeout, and the queued commands of deleted apps.
+    :return: the number of failed commands
+    '''
+    now = timezone.now()
+    stale = Command.objects.filter(status=COMMAND_RUNNING, claim_time__lt=now - datetime.timedelta(seconds=service_settings.command_timeout))
+    failed = stale.update(status=COMMAND_FAILED, progress=1.0, finish_time=now,
+                          results=json.dumps({'info': 'The worker running the command stopped.'}))
+    failed += Command.objects.filter(status=COMMAND_QUEUED, app__is_active=False).update(
+        status=COMMAND_FAILED, progress=1.0, finish_time=now, results=json.dumps({'info': 'App Not Found'}))
+    if failed != 0:
+        log.warning('%d commands failed, stopped worker or deleted app.' % (failed))
+    return failed
+
+
+def claim_next():
+    '''
+    :return: the oldest queued command of an active app, now running, or None if there is no queued command
+    '''
+    fail_stale()
+    for commandID in Command.objects.filter(status=COMMAND_QUEUED, app__is_active=True).order_by('issue_time').values_list('id', flat=True)[:10]:
+        if Command.objects.filter(id=commandID, status=COMMAND_QUEUED).update(status=COMMAND_RUNNING, claim_time=timezone.now()) == 1:
+            return Command.objects.get(id=commandID)
+    return None
+
+
+def run_command(command):
+    '''
+    Execute the service of the command, record its progress while running and its results once finished.
+    :param command: a running Command
+    '''
+    connection_pool.touch(app_database(command.app.appID))
+    services = [service for service in SERVICES if service[0] == command.serviceID]
+    data = json.loads(command.arguments) if command.arguments else {}
+
+    def progress(fraction):
+        # also the heartbeat of the worker, see fail_stale()
+        Command.objects.filter(id=command.id).update(progress=fraction, claim_time=timezone.now())
+
+    try:
+        if len(services) == 0:
+            raise ValueError('Service %d not found.' % (command.serviceID))
+        results = services[0][2]().execute(data=data, app=command.app, progress=progress)
+        command.status = COMMAND_DONE
+    except Exception as e:
+        log.exception('Command %d failed.' % (command.id))
+        results = {'info': str(e)}
+        command.status = COMMAND_FAILED
+
+    command.results = encode_results(results)
+    command.progress = 1.0
+    command.finish_time = timezone.now()
+    command.save(update_fields=['status', 'progress', 'results', 'finish_time'])
+    log.info('Command %d %s.' % (command.id, command.status))
+
+    # the worker does not finish requests
+    connection_pool.evict()
@@ -0,0 +1,62 @@
+from django.db import models
+# data
+import numpy as np
+import struct
+import json
+
+# the stored vector: magic, rows, columns (little-endian uint32), then the float32 data in C order
+VECTOR_MAGIC = b'VEC1'
+VECTOR_HEADER = struct.Struct('<4sII')
+
+
+def encode_vector(value):
+    '''
+    :param value: numpy array or (nested) list of at most 2 dimensions
+    :return: the bytes to store
+    '''
+    array = np.asarray(value, dtype=np.float32)
+    if array.ndim < 2:
+        array = array.reshape([-1, 1])
+    assert(array.ndim == 2)
+    return VECTOR_HEADER.pack(VECTOR_MAGIC, array.shape[0], array.shape[1]) + np.ascontiguousarray(array).tobytes()
+
+
+def is_encoded(value):
+    # sqlite returns the json text stored before the binary format as str
+    if value is None or isinstance(value, str):
+        return False
+    return bytes(value[:len(VECTOR_MAGIC)]) == VECTOR_MAGIC
+
+
+def decode_vector(value):
+    '''
+    :param value: the stored bytes, or the json text of a vector stored before the binary format
+    :return: the numpy array, a read only view on the stored bytes
+    '''
+    if value is None or len(value) == 0:
+        return None
+    if isinstance(value, str):
+        return np.array(json.loads(value))
+    if not is_encoded(value):
+        return np.array(json.loads(bytes(value).decode('latin1')))
+
+    magic, rows, columns = VECTOR_HEADER.unpack_from(value)
+    return np.frombuffer(value, dtype=np.float32, count=rows * columns, offset=VECTOR_HEADER.size).reshape([rows, columns])
+
+
+class VectorField(models.BinaryField):
+    '''
+    A float32 vector stored as binary with its shape in a small header. Reads are a zero-copy np.frombuffer.
+    '''
+    def from_db_value(self, value, expression, connection, context):
+        return decode_vector(value)
+
+    def to_python(self, value):
+        if value is None or isinstance(value, np.ndarray):
+            return value
+        return decode_vector(value)
+
+    def get_db_prep_value(self, value, connection, prepared=False):
+        if value is not None and not isinstance(value, (bytes, bytearray, memoryview)):
+            value = encode_vector(value)
+        return super().get_db_prep_value(value, connection, prepared)
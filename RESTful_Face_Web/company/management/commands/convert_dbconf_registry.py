@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from RESTful_Face_Web import settings
+from RESTful_Face_Web.runtime_db.registry import update_registry
+import types
+import os
+
+
+class Command(BaseCommand):
+    help = 'Move the app database settings of the .dbconf files into the JSON registry read on demand by the workers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--delete', action='store_true', help='Delete the .dbconf files once converted.')
+
+    def handle(self, *args, **options):
+        filenames = sorted(filename for filename in os.listdir(settings.DB_SETTINGS_BASE_DIR) if filename.endswith('.dbconf'))
+
+        databases = {}
+        for filename in filenames:
+            with open(os.path.join(settings.DB_SETTINGS_BASE_DIR, filename)) as f:
+                db_settings = f.read()
+            # a .dbconf file assigns settings.DATABASES[alias]
+            namespace = types.SimpleNamespace(DATABASES={})
+            try:
+                exec(db_settings, {'settings': namespace})
+            except Exception as e:
+                raise CommandError('%s cannot be read: %s' % (filename, e))
+            databases.update(namespace.DATABASES)
+
+        update_registry(settings.DB_REGISTRY_FILE, add=databases)
+        self.stdout.write('%d databases registered in %s.' % (len(databases), settings.DB_REGISTRY_FILE))
+
+        if options['delete']:
+            for filename in filenames:
+                os.remove(os.path.join(settings.DB_SETTINGS_BASE_DIR, filename))
+            self.stdout.write('%d .dbconf files deleted.' % (len(filenames)))
@@ -0,0 +1,139 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+# models
+from company.models import App, Subject, Face, Feature, FeatureTemplate, ClassifierModel
+from RESTful_Face_Web.settings import SHARED_TENANT_DATABASE
+from contextlib import contextmanager
+
+
+# the shared subjects are looked up by appID (the classifier models already have a unique key starting with it)
+SHARED_INDEXES = [
+    ('company_subject', 'company_subject_appID_subjectID', 'CREATE INDEX `company_subject_appID_subjectID` ON `company_subject` (`appID`, `subjectID`)'),
+]
+
+
+@contextmanager
+def keep_timestamps(*Models):
+    '''
+    Copy created_time and modified_time as they are instead of setting them to now.
+    '''
+    fields = [field for Model in Models for field in Model._meta.fields if getattr(field, 'auto_now', False) or getattr(field, 'auto_now_add', False)]
+    saved = [(field, field.auto_now, field.auto_now_add) for field in fields]
+    for field in fields:
+        field.auto_now = field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field, auto_now, auto_now_add in saved:
+            field.auto_now, field.auto_now_add = auto_now, auto_now_add
+
+
+class Command(BaseCommand):
+    help = 'Copy the per-app databases into the tables shared by all apps (settings.TENANT_MODE = \'shared\').'
+
+    models = [Subject, Face, Feature, ClassifierModel, FeatureTemplate]
+
+    def add_arguments(self, parser):
+        parser.add_argument('apps', nargs='*', help='appIDs to migrate. All active apps by default.')
+        parser.add_argument('--create-tables', action='store_true', help='Create the shared tables first.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows inserted per query.')
+
+    def handle(self, *args, **options):
+        if SHARED_TENANT_DATABASE not in connections.databases:
+            raise CommandError('Database %s is not configured.' % (SHARED_TENANT_DATABASE))
+
+        if options['create_tables']:
+            self.create_tables(connections[SHARED_TENANT_DATABASE])
+
+        appIDs = options['apps'] or list(App.objects.filter(is_active=True).values_list('appID', flat=True))
+        for appID in appIDs:
+            if appID not in connections.databases:
+                raise CommandError('Database of app %s is not registered.' % (appID))
+            if Subject.objects.using(SHARED_TENANT_DATABASE).filter(appID=appID).exists():
+                self.stdout.write('App %s: already in the shared database, skipped.' % (appID))
+                continue
+
+            with transaction.atomic(using=SHARED_TENANT_DATABASE), keep_timestamps(*self.models):
+                counts, orphans = self.migrate(appID, options['chunk_size'])
+            self.stdout.write('App %s: %s migrated.' % (appID, ', '.join('%d %s' % (count, name) for name, count in counts)))
+            if any(count != 0 for name, count in orphans):
+                self.stderr.write('App %s: orphans skipped, %s.' % (appID, ', '.join('%d %s' % (count, name) for name, count in orphans)))
+
+    def create_tables(self, connection):
+        with connection.cursor() as cursor:
+            tables = connection.introspection.table_names(cursor)
+            for Model in self.models:
+                if Model._meta.db_table not in tables:
+                    [cursor.execute(sql) for sql in Model.generate_mysql()]
+                    self.stdout.write('Table %s created.' % (Model._meta.db_table))
+
+            for table, name, sql in SHARED_INDEXES:
+                cursor.execute('SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s', [table, name])
+                if cursor.fetchone()[0] == 0:
+                    cursor.execute(sql)
+                    self.stdout.write('Index %s created.' % (name))
+
+    def migrate(self, appID, chunk_size):
+        '''
+        Copy the rows of the app, the ids change so the foreign keys are mapped to the new ones.
+        The rows whose subject or face does not exist (orphans, the app tables may not have foreign keys) are skipped.
+        :return: list of (table, rows copied), list of (table, orphans skipped)
+        '''
+        target = SHARED_TENANT_DATABASE
+
+        # subjects, mapped by subjectID
+        subjects = list(Subject.objects.using(appID).all())
+        old_subject_ids = dict((subject.subjectID, subject.id) for subject in subjects)
+        for subject in subjects:
+            subject.id = None
+        Subject.objects.using(target).bulk_create(subjects, batch_size=chunk_size)
+        subject_map = dict((old_subject_ids[subjectID], subject_id) for subjectID, subject_id in
+                           Subject.objects.using(target).filter(appID=appID).values_list('subjectID', 'id'))
+
+        # faces, mapped by their unique image path, inserted in the same order so the ids keep their order
+        app_faces = list(Face.objects.using(appID).all().order_by('id'))
+        faces = [face for face in app_faces if face.subject_id in subject_map]
+        orphan_faces = len(app_faces) - len(faces)
+        old_face_ids = dict((face.image.name, face.id) for face in faces)
+        for face in faces:
+            face.id = None
+            face.subject_id = subject_map[face.subject_id]
+        Face.objects.using(target).bulk_create(faces, batch_size=chunk_size)
+        face_map = dict((old_face_ids[image], face_id) for image, face_id in
+                        Face.objects.using(target).filter(subject__appID=appID).values_list('image', 'id'))
+
+        features = 0
+        orphan_features = 0
+        chunk = []
+        for feature in Feature.objects.using(appID).all().iterator():
+            if feature.face_id not in face_map:
+                orphan_features += 1
+                continue
+            feature.id = None
+            feature.face_id = face_map[feature.face_id]
+            chunk.append(feature)
+            if len(chunk) == chunk_size:
+                Feature.objects.using(target).bulk_create(chunk)
+                features += len(chunk)
+                chunk = []
+        Feature.objects.using(target).bulk_create(chunk)
+        features += len(chunk)
+
+        app_templates = list(FeatureTemplate.objects.using(appID).all())
+        templates = [template for template in app_templates if template.subject_id in subject_map]
+        orphan_templates = len(app_templates) - len(templates)
+        for template in templates:
+            template.id = None
+            template.subject_id = subject_map[template.subject_id]
+            # the last summed face may be deleted since, then the count check of the enrollment recomputes the template
+            template.last_face_id = face_map.get(template.last_face_id, 0)
+        FeatureTemplate.objects.using(target).bulk_create(templates, batch_size=chunk_size)
+
+        classifier_models = list(ClassifierModel.objects.using(appID).all())
+        for classifier_model in classifier_models:
+            classifier_model.id = None
+        ClassifierModel.objects.using(target).bulk_create(classifier_models, batch_size=chunk_size)
+
+        return ([('subjects', len(subjects)), ('faces', len(faces)), ('features', features),
+                 ('templates', len(templates)), ('classifier models', len(classifier_models))],
+                [('faces', orphan_faces), ('features', orphan_features), ('templates', orphan_templates)])
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+# models
+from company.models import App
+from company.fields import encode_vector, decode_vector, is_encoded
+
+
+class Command(BaseCommand):
+    help = 'Convert the json text vectors of Feature and FeatureTemplate in the app databases into float32 binary.'
+
+    # table, nullable data column
+    tables = [('company_feature', False), ('company_featuretemplate', True)]
+
+    def add_arguments(self, parser):
+        parser.add_argument('apps', nargs='*', help='appIDs to migrate. All active apps by default.')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Rows converted per transaction.')
+
+    def handle(self, *args, **options):
+        appIDs = options['apps'] or list(App.objects.filter(is_active=True).values_list('appID', flat=True))
+
+        for appID in appIDs:
+            if appID not in connections.databases:
+                raise CommandError('Database of app %s is not registered.' % (appID))
+
+            connection = connections[appID]
+            for table, nullable in self.tables:
+                self.alter_column(connection, table, nullable)
+                converted = self.convert_rows(connection, appID, table, options['chunk_size'])
+                self.stdout.write('App %s, %s: %d rows converted.' % (appID, table, converted))
+
+    def alter_column(self, connection, table, nullable):
+        # sqlite keeps any value in any column, only mysql needs the new column type
+        if connection.vendor != 'mysql':
+            return
+        with connection.cursor() as cursor:
+            cursor.execute('ALTER TABLE `%s` MODIFY `data` blob %s' % (table, 'NULL' if nullable else 'NOT NULL'))
+
+    def convert_rows(self, connection, appID, table, chunk_size):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT id FROM %s ORDER BY id' % (table))
+            ids = [row[0] for row in cursor.fetchall()]
+
+        converted = 0
+        for start in range(0, len(ids), chunk_size):
+            chunk = ids[start:start + chunk_size]
+            with transaction.atomic(using=appID), connection.cursor() as cursor:
+                cursor.execute('SELECT id, data FROM %s WHERE id IN (%s)' % (table, ', '.join(['%s'] * len(chunk))), chunk)
+                rows = [(encode_vector(decode_vector(data)), id) for id, data in cursor.fetchall()
+                        if data is not None and len(data) != 0 and not is_encoded(data)]
+                if len(rows) != 0:
+                    cursor.executemany('UPDATE %s SET data = %%s WHERE id = %%s' % (table), rows)
+                converted += len(rows)
+        return converted
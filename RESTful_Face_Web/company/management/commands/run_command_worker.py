@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+# commands
+from company.command_worker import claim_next, run_command
+# register the services
+from service import services
+import time
+
+
+class Command(BaseCommand):
+    help = 'Run the queued commands (e.g. /commands/enroll/) one at a time.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when there is no queued command left.')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds to wait when there is no queued command.')
+
+    def handle(self, *args, **options):
+        while True:
+            command = claim_next()
+            if command is None:
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+                continue
+
+            self.stdout.write('Command %d: %s' % (command.id, command.get_service_name()))
+            run_command(command)
@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, DatabaseError
+# models
+from company.models import App, Subject, Face, Feature, FeatureTemplate, ClassifierModel
+
+
+class Command(BaseCommand):
+    help = ('Add the columns and indexes introduced after an app database was created (see upgrade_mysql() of the models). '
+            'Indexes are built online (ALGORITHM=INPLACE, LOCK=NONE), the tables stay writable.')
+
+    models = [Subject, Face, Feature, FeatureTemplate, ClassifierModel]
+
+    def add_arguments(self, parser):
+        parser.add_argument('apps', nargs='*', help='appIDs to upgrade. All active apps by default.')
+        parser.add_argument('--dedupe', action='store_true',
+                            help='Delete the duplicated rows preventing a unique index first (see dedupe_mysql() of the models).')
+
+    def handle(self, *args, **options):
+        appIDs = options['apps'] or list(App.objects.filter(is_active=True).values_list('appID', flat=True))
+
+        for appID in appIDs:
+            if appID not in connections.databases:
+                raise CommandError('Database of app %s is not registered.' % (appID))
+
+            connection = connections[appID]
+            if connection.vendor != 'mysql':
+                self.stdout.write('App %s: only mysql databases can be upgraded, skipped.' % (appID))
+                continue
+
+            for Model in self.models:
+                if not hasattr(Model, 'upgrade_mysql'):
+                    continue
+                table = Model._meta.db_table
+                dedupe = Model.dedupe_mysql() if options['dedupe'] and hasattr(Model, 'dedupe_mysql') else {}
+                for kind, name, sql in Model.upgrade_mysql():
+                    if self.exists(connection, table, kind, name):
+                        continue
+                    try:
+                        with connection.cursor() as cursor:
+                            if name in dedupe:
+                                cursor.execute(dedupe[name])
+                                self.stdout.write('App %s, %s: %d duplicated rows deleted.' % (appID, table, cursor.rowcount))
+                            cursor.execute(sql)
+                    except DatabaseError as e:
+                        # e.g. duplicated rows preventing a unique index (see --dedupe), the other changes are still applied
+                        self.stderr.write('App %s, %s: %s %s failed: %s' % (appID, table, kind, name, e))
+                        continue
+                    self.stdout.write('App %s, %s: %s %s added.' % (appID, table, kind, name))
+
+    def exists(self, connection, table, kind, name):
+        if kind == 'column':
+            sql = 'SELECT COUNT(*) FROM information_schema.columns WHERE table_schema = DATABASE() AND table_name = %s AND column_name = %s'
+        else:
+            sql = 'SELECT COUNT(*) FROM information_schema.statistics WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s'
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [table, name])
+            return cursor.fetchone()[0] != 0
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.contrib.auth.models import User
 from django.core.validators import RegexValidator
 # utils
@@ -8,9 +8,14 @@ import os
 from django.utils.dateparse import parse_duration
 from django.utils import timezone
 # service
-from RESTful_Face_Web.settings import MEDIA_ROOT
+from RESTful_Face_Web.settings import MEDIA_ROOT, TENANT_MODE, SHARED_TENANT_DATABASE
+from RESTful_Face_Web.runtime_db import connection_pool
 # face feature
 from service.settings import feature_dimension
+from .fields import VectorField
+# logging
+import logging
+log = logging.getLogger(__name__)
 
 # Create your models here.
 
@@ -28,6 +33,9 @@ class App(models.Model):
 
     update_time = models.DateTimeField(auto_now=True)
 
+    # comma separated features extracted when a face is uploaded, empty for all of them
+    enabled_features = models.CharField(max_length=200, blank=True, default='')
+
     def get_status(self):
         return 'live' if self.is_active else 'closed'
 
@@ -37,6 +45,9 @@ class App(models.Model):
     def get_update_time(self):
         return timezone.localtime(self.update_time)
 
+    def get_enabled_features(self):
+        return [name.strip().upper() for name in self.enabled_features.split(',') if name.strip() != '']
+
     def delete(self, using=None, keep_parents=False):
         faces_path = os.path.join(MEDIA_ROOT, 'faces', str(self.appID))
         models_path = os.path.join(MEDIA_ROOT, 'classifier models', str(self.appID))
@@ -59,16 +70,43 @@ class Token2Token(models.Model):
         return self.duration.__str__()
 
 
+def app_database(appID):
+    '''
+    :return: the database alias holding the data of the app
+    '''
+    return SHARED_TENANT_DATABASE if TENANT_MODE == 'shared' else appID
+
+
+class AppQuerySet(models.QuerySet):
+    def for_app(self, appID):
+        '''
+        The rows of the app: its own database, or its rows of the shared database (see settings.TENANT_MODE).
+        '''
+        queryset = self.using(app_database(appID))
+        if TENANT_MODE == 'shared':
+            queryset = queryset.filter(**{self.model.app_lookup: appID})
+        return queryset
+
+
 def get_target_app(company, appID=None):
     """Find the target active app of company with the specified appID"""
     apps = App.objects.filter(company=company, is_active=True).all()
     if appID != None:
         apps = apps.filter(appID=appID)
-    return None if len(apps)==0 else apps[0]
+    if len(apps) == 0:
+        return None
+    connection_pool.touch(app_database(apps[0].appID))
+    return apps[0]
 
 
 SERVICES = []
 
+# status of a command, queued commands are run by the command worker (manage.py run_command_worker)
+COMMAND_QUEUED = 'queued'
+COMMAND_RUNNING = 'running'
+COMMAND_DONE = 'done'
+COMMAND_FAILED = 'failed'
+
 class Command(models.Model):
     company = models.ForeignKey(User, related_name="commands", on_delete=models.CASCADE)
     app = models.ForeignKey(App, related_name="commands", on_delete=models.CASCADE)
@@ -78,6 +116,12 @@ class Command(models.Model):
     arguments = models.CharField(max_length=1024, blank=True)
     results = models.CharField(max_length=1024, blank=True)
 
+    status = models.CharField(max_length=20, default=COMMAND_DONE, db_index=True)
+    progress = models.FloatField(default=1.0)
+    finish_time = models.DateTimeField(null=True, blank=True)
+    # when a worker claimed the command, refreshed by its progress updates
+    claim_time = models.DateTimeField(null=True, blank=True)
+
     def get_service_name(self):
         r = [service[1] for service in SERVICES if service[0]==self.serviceID]
         print(r)
@@ -86,6 +130,9 @@ class Command(models.Model):
     def get_issue_time(self):
         return timezone.localtime(self.issue_time)
 
+    def get_finish_time(self):
+        return None if self.finish_time is None else timezone.localtime(self.finish_time)
+
 #################### Data For Company ###################
 
 class Subject(models.Model):
@@ -100,9 +147,12 @@ class Subject(models.Model):
     :param created_time, modified_time: self explanatory
     
     '''
-    subjectID = models.CharField(max_length=50)
+    subjectID = models.CharField(max_length=50, db_index=True)
     appID = models.CharField(max_length=50)
 
+    objects = AppQuerySet.as_manager()
+    app_lookup = 'appID'
+
     created_time = models.DateTimeField(auto_now_add=True)
     modified_time = models.DateTimeField(auto_now=True)
 
@@ -145,9 +195,17 @@ class Subject(models.Model):
   `first_name` varchar(30) NOT NULL,
   `last_name` varchar(30) NOT NULL,
   `note` varchar(200) NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  KEY `company_subject_subjectID` (`subjectID`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1''', ]
 
+    @staticmethod
+    def upgrade_mysql():
+        '''
+        :return: what was added after the table was first generated, list of ('column' or 'index', name, sql)
+        '''
+        return [('index', 'company_subject_subjectID', 'ALTER TABLE `company_subject` ADD INDEX `company_subject_subjectID` (`subjectID`), ALGORITHM=INPLACE, LOCK=NONE'), ]
+
 def face_file_path(instance, filename):
     return instance.subject.get_faces_dir()+'{2}/{3}'.format(instance.subject.appID, instance.subject.subjectID, datetime.now().strftime("%y%m%d"), filename)
 
@@ -157,6 +215,9 @@ class Face(models.Model):
     created_time = models.DateField(auto_now_add=True)
     modified_time = models.DateField(auto_now=True)
 
+    objects = AppQuerySet.as_manager()
+    app_lookup = 'subject__appID'
+
     @staticmethod
     def generate_sqlite():
         return ['''CREATE TABLE "company_face" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "image" varchar(100) NOT NULL, "created_time" date NOT NULL, "modified_time" date NOT NULL, "person_id" integer NOT NULL REFERENCES "company_person" ("id"));''',
@@ -188,25 +249,36 @@ class FeatureTemplate(models.Model):
     feature_name = models.CharField(max_length=50)
     subject = models.ForeignKey(Subject, on_delete=models.CASCADE, related_name='templates')
 
-    data = models.CharField(max_length=20000, blank=True)
+    data = VectorField(null=True, blank=True)
     created_time = models.DateTimeField(auto_now_add=True)
     modified_time = models.DateTimeField(auto_now=True)
 
+    # running sum of the faces' features for incremental enrollment, data = feature_sum / face_count
+    feature_sum = VectorField(null=True, blank=True)
+    face_count = models.IntegerField(default=0)
+    last_face_id = models.IntegerField(default=0) # faces with larger id are not in the sum yet
+
+    objects = AppQuerySet.as_manager()
+    app_lookup = 'subject__appID'
+
     class Meta:
         unique_together = (('feature_name', 'subject'),)
 
     @staticmethod
     def generate_sqlite():
-        return ['''CREATE TABLE "company_featuregallery" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "name" varchar(50) NOT NULL, "data" varchar(20000) NOT NULL, "created_time" datetime NOT NULL, "modified_time" datetime NOT NULL, "person_id" integer NOT NULL UNIQUE REFERENCES "company_person" ("id"));''']
+        return ['''CREATE TABLE "company_featuregallery" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "name" varchar(50) NOT NULL, "data" BLOB NULL, "created_time" datetime NOT NULL, "modified_time" datetime NOT NULL, "feature_sum" BLOB NULL, "face_count" integer NOT NULL DEFAULT 0, "last_face_id" integer NOT NULL DEFAULT 0, "person_id" integer NOT NULL UNIQUE REFERENCES "company_person" ("id"));''']
 
     @staticmethod
     def generate_mysql():
         return ['''CREATE TABLE `company_featuretemplate` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
   `feature_name` varchar(50) NOT NULL,
-  `data` varchar(20000) NOT NULL,
+  `data` blob,
   `created_time` datetime NOT NULL,
   `modified_time` datetime NOT NULL,
+  `feature_sum` blob,
+  `face_count` int(11) NOT NULL DEFAULT 0,
+  `last_face_id` int(11) NOT NULL DEFAULT 0,
   `subject_id` int(11) NOT NULL,
   PRIMARY KEY (`id`),
   UNIQUE KEY `company_featuretemplate_feature_name_subject_id_b1249808_uniq` (`feature_name`,`subject_id`),
@@ -214,29 +286,96 @@ class FeatureTemplate(models.Model):
   CONSTRAINT `company_featuretempl_subject_id_d2d5f098_fk_company_s` FOREIGN KEY (`subject_id`) REFERENCES `company_subject` (`id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1''', ]
 
+    @staticmethod
+    def upgrade_mysql():
+        '''
+        :return: what was added after the table was first generated, list of ('column' or 'index', name, sql)
+        '''
+        return [('column', 'feature_sum', 'ALTER TABLE `company_featuretemplate` ADD COLUMN `feature_sum` blob'),
+                ('column', 'face_count', 'ALTER TABLE `company_featuretemplate` ADD COLUMN `face_count` int(11) NOT NULL DEFAULT 0'),
+                ('column', 'last_face_id', 'ALTER TABLE `company_featuretemplate` ADD COLUMN `last_face_id` int(11) NOT NULL DEFAULT 0'), ]
+
 class Feature(models.Model):
     face = models.ForeignKey(Face, related_name='features', on_delete=models.CASCADE)
-    data = models.CharField(max_length=20000) # use json dump
+    data = VectorField() # float32 binary, see fields.py
     feature_name = models.CharField(max_length=50) # the name of feature
     created_time = models.DateTimeField(auto_now_add=True)
 
+    objects = AppQuerySet.as_manager()
+    app_lookup = 'face__subject__appID'
+
+    class Meta:
+        unique_together = (('face', 'feature_name'),)
+        index_together = (('feature_name', 'face'),)
+
     @staticmethod
     def generate_sqlite():
-        return ['''CREATE TABLE "company_feature" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "data" varchar(2000) NOT NULL, "name" varchar(50) NOT NULL, "created_time" datetime NOT NULL, "face_id" integer NOT NULL UNIQUE REFERENCES "company_face" ("id"));''', ]
+        return ['''CREATE TABLE "company_feature" ("id" integer NOT NULL PRIMARY KEY AUTOINCREMENT, "data" BLOB NOT NULL, "name" varchar(50) NOT NULL, "created_time" datetime NOT NULL, "face_id" integer NOT NULL UNIQUE REFERENCES "company_face" ("id"));''', ]
 
     @staticmethod
     def generate_mysql():
         return ['''CREATE TABLE `company_feature` (
   `id` int(11) NOT NULL AUTO_INCREMENT,
-  `data` varchar(20000) NOT NULL,
+  `data` blob NOT NULL,
   `feature_name` varchar(50) NOT NULL,
   `created_time` datetime NOT NULL,
   `face_id` int(11) NOT NULL,
   PRIMARY KEY (`id`),
+  UNIQUE KEY `company_feature_face_id_feature_name_uniq` (`face_id`,`feature_name`),
+  KEY `company_feature_feature_name_face_id` (`feature_name`,`face_id`),
   KEY `company_feature_face_id_a66f0874_fk_company_face_id` (`face_id`),
   CONSTRAINT `company_feature_face_id_a66f0874_fk_company_face_id` FOREIGN KEY (`face_id`) REFERENCES `company_face` (`id`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1''', ]
 
+    @staticmethod
+    def upgrade_mysql():
+        '''
+        :return: what was added after the table was first generated, list of ('column' or 'index', name, sql)
+        '''
+        return [('index', 'company_feature_face_id_feature_name_uniq', 'ALTER TABLE `company_feature` ADD UNIQUE INDEX `company_feature_face_id_feature_name_uniq` (`face_id`, `feature_name`), ALGORITHM=INPLACE, LOCK=NONE'),
+                ('index', 'company_feature_feature_name_face_id', 'ALTER TABLE `company_feature` ADD INDEX `company_feature_feature_name_face_id` (`feature_name`, `face_id`), ALGORITHM=INPLACE, LOCK=NONE'), ]
+
+    @staticmethod
+    def dedupe_mysql():
+        '''
+        :return: {unique index: sql deleting the rows it would reject}, the first feature of a face is kept
+        '''
+        return {'company_feature_face_id_feature_name_uniq': '''DELETE `f` FROM `company_feature` `f` JOIN (
+  SELECT `face_id`, `feature_name`, MIN(`id`) AS `id` FROM `company_feature` GROUP BY `face_id`, `feature_name` HAVING COUNT(*) > 1
+) `k` ON `f`.`face_id` = `k`.`face_id` AND `f`.`feature_name` = `k`.`feature_name` AND `f`.`id` > `k`.`id`'''}
+
+
+def insert_features(appID, features):
+    '''
+    Insert the new features of faces. The enrollment and a queued feature extraction may compute the same features at
+    the same time, then the rows the other one inserted first (unique face and feature_name) are kept.
+    :return: {(face id, feature_name): data} of the features already in the database, read again
+    '''
+    database = app_database(appID)
+    try:
+        with transaction.atomic(using=database):
+            Feature.objects.for_app(appID).bulk_create(features)
+        return {}
+    except IntegrityError:
+        pass
+
+    # one by one, skipping the conflicts
+    conflicts = []
+    for feature in features:
+        try:
+            with transaction.atomic(using=database):
+                feature.save(using=database)
+        except IntegrityError:
+            conflicts.append(feature)
+    log.info('App %s: %d features were already inserted.' % (appID, len(conflicts)))
+
+    saved = {}
+    for feature_name in set(feature.feature_name for feature in conflicts):
+        for face_id, data in Feature.objects.for_app(appID).filter(face__in=[feature.face_id for feature in conflicts if feature.feature_name == feature_name],
+                                                                   feature_name=feature_name).values_list('face_id', 'data'):
+            saved[(face_id, feature_name)] = data
+    return saved
+
 
 def classifier_file_path(instance, filename):
     return 'classifier models/{0}/{1}/{2}/{3}'.format(instance.appID, instance.classifier_name, instance.feature_name, filename)
@@ -250,6 +389,12 @@ class ClassifierModel(models.Model):
     created_time = models.DateTimeField(auto_now_add=True)
     modified_time = models.DateTimeField(auto_now=True)
 
+    objects = AppQuerySet.as_manager()
+    app_lookup = 'appID'
+
+    class Meta:
+        unique_together = (('appID', 'feature_name', 'classifier_name'),)
+
     #additional_data = models.FileField(upload_to=classifier_file_path, blank=True)
 
     @staticmethod
@@ -266,5 +411,14 @@ class ClassifierModel(models.Model):
   `parameter_file` varchar(100) NOT NULL,
   `created_time` datetime NOT NULL,
   `modified_time` datetime NOT NULL,
-  PRIMARY KEY (`id`)
+  PRIMARY KEY (`id`),
+  UNIQUE KEY `company_classifiermodel_appID_feature_name_classifier_name_uniq` (`appID`,`feature_name`,`classifier_name`)
 ) ENGINE=InnoDB DEFAULT CHARSET=latin1''', ]
+
+    @staticmethod
+    def upgrade_mysql():
+        '''
+        :return: what was added after the table was first generated, list of ('column' or 'index', name, sql)
+        '''
+        return [('index', 'company_classifiermodel_appID_feature_name_classifier_name_uniq',
+                 'ALTER TABLE `company_classifiermodel` ADD UNIQUE INDEX `company_classifiermodel_appID_feature_name_classifier_name_uniq` (`appID`, `feature_name`, `classifier_name`), ALGORITHM=INPLACE, LOCK=NONE'), ]
@@ -2,9 +2,11 @@
 from rest_framework import serializers
 # model
 from django.contrib.auth.models import User
-from .models import Subject, Face, Command, App, Token2Token
+from .models import Subject, Face, Command, App, Token2Token, app_database
 # utils
 from rest_framework.utils import model_meta
+# service
+from service import settings as service_settings
 
 class CompanySerializer(serializers.ModelSerializer):
     companyID = serializers.CharField(source="first_name", read_only=True)
@@ -48,14 +50,14 @@ class SubjectSerializer(serializers.HyperlinkedModelSerializer):
         read_only_fields = ('subjectID', 'appID')
 
     def create(self, validated_data):
-        return Subject.objects.db_manager(validated_data['appID']).create(**validated_data)
+        return Subject.objects.for_app(validated_data['appID']).create(**validated_data)
 
     def update(self, instance, validated_data):
         serializers.raise_errors_on_nested_writes('update', self, validated_data)
 
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
-        instance.save(using=instance.appID)
+        instance.save(using=app_database(instance.appID))
         return instance
 
 class FaceSerializer(serializers.HyperlinkedModelSerializer):
@@ -69,7 +71,7 @@ class FaceSerializer(serializers.HyperlinkedModelSerializer):
 
     # override to user company's database
     def create(self, validated_data):
-        return Face.objects.db_manager(validated_data['subject'].appID).create(**validated_data)
+        return Face.objects.for_app(validated_data['subject'].appID).create(**validated_data)
 
     # override to use company's database
     def update(self, instance, validated_data):
@@ -89,15 +91,23 @@ class AppSerializer(serializers.HyperlinkedModelSerializer):
 
     class Meta:
         model = App
-        fields = ('company', 'app_name', 'status', 'appID', 'update_time')
+        fields = ('company', 'app_name', 'status', 'appID', 'update_time', 'enabled_features')
         read_only_fields = ['company', 'appID', 'update_time']
 
+    def validate_enabled_features(self, value):
+        names = [name.strip().upper() for name in value.split(',') if name.strip() != '']
+        invalid = [name for name in names if name not in service_settings.all_feature_names]
+        if len(invalid) != 0:
+            raise serializers.ValidationError('Feature name is invalid: ' + ', '.join(invalid) + '. Valid options: ' + ', '.join(service_settings.all_feature_names) + '.')
+        return ','.join(names)
+
 
 class CommandSerializer(serializers.HyperlinkedModelSerializer):
     service = serializers.CharField(source='get_service_name')
     issue_time = serializers.CharField(source='get_issue_time')
+    finish_time = serializers.CharField(source='get_finish_time', read_only=True)
     app = AppSerializer(required=False)
 
     class Meta:
         model = Command
-        fields = ('id', 'url', 'company', 'app', 'service', 'issue_time', 'arguments', 'results')
+        fields = ('id', 'url', 'company', 'app', 'service', 'issue_time', 'arguments', 'status', 'progress', 'finish_time', 'results')
@@ -4,6 +4,10 @@ import os
 from rest_framework import status
 from rest_framework.reverse import reverse
 from RESTful_Face_Web.settings import BASE_DIR
+# vector storage
+from django.test import SimpleTestCase
+from .fields import encode_vector, decode_vector, is_encoded
+import numpy as np
 
 # Create your tests here.
 
@@ -156,6 +160,30 @@ class CompaniesCRUDTest(TestCase):
 
         requests.delete(os.path.join(self.host, 'company/', str(user['id']) + '/'), auth=(admin_name, admin_password))
 '''
+class VectorStorageTest(SimpleTestCase):
+    def test_round_trip(self):
+        vector = np.random.RandomState(0).randn(128, 1).astype(np.float32)
+        encoded = encode_vector(vector)
+        self.assertTrue(is_encoded(encoded))
+        np.testing.assert_array_equal(decode_vector(encoded), vector)
+        np.testing.assert_array_equal(decode_vector(memoryview(encoded)), vector)
+
+    def test_round_trip_1d_and_list(self):
+        self.assertEqual(decode_vector(encode_vector([1, 2, 3])).shape, (3, 1))
+        np.testing.assert_array_equal(decode_vector(encode_vector([[1, 2], [3, 4]])), [[1, 2], [3, 4]])
+
+    def test_json_text(self):
+        # mysql returns the old rows as bytes, sqlite as str
+        for value in ['[[1.5], [2.0]]', b'[[1.5], [2.0]]']:
+            self.assertFalse(is_encoded(value))
+            np.testing.assert_array_equal(decode_vector(value), [[1.5], [2.0]])
+
+    def test_empty(self):
+        self.assertIsNone(decode_vector(None))
+        self.assertIsNone(decode_vector(b''))
+        self.assertFalse(is_encoded(None))
+
+
 class PersonTest(TestCase):
 
     host = 'http://127.0.0.1:8000/'
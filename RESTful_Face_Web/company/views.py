@@ -26,19 +26,23 @@ from .utils.retrieve_admin import get_admin
 from RESTful_Face_Web.settings import EXPIRING_TOKEN_LIFESPAN, MEDIA_ROOT
 from rest_framework.decorators import list_route
 import datetime
-from PIL import Image
-import numpy as np
 from django.utils import timezone
 import os, shutil
-import cv2
 import json
 # service
-from service import services, extraction
+from service import services, model_registry
+from service import settings as service_settings
+from service.image_ingest import decode_image, ImageError
+from service.feature_extraction import enabled_features
+from service.gallery import gallery_cache
+from .bulk_upload import BulkFaceUpload, ManifestError, parse_manifest, read_archive_manifest
 
 #import uwsgi
 from RESTful_Face_Web.runtime_db import load_database
-from RESTful_Face_Web.runtime_db.runtime_database import MySQLManager
-myDBManager = MySQLManager()
+from RESTful_Face_Web.runtime_db.runtime_database import MySQLManager, SharedSchemaManager
+from RESTful_Face_Web.runtime_db import connection_pool
+from RESTful_Face_Web.settings import TENANT_MODE
+myDBManager = SharedSchemaManager() if TENANT_MODE == 'shared' else MySQLManager()
 #from RESTful_Face_Web.runtime_db.runtime_database import SQLiteManager
 #myDBManager = SQLiteManager()
 
@@ -126,7 +130,7 @@ class CompanyViewSet(mixins.RetrieveModelMixin,
     def perform_destroy(self, instance):
         apps = App.objects.filter(company=instance, is_active=True)
         for app in apps:
-            persons = Subject.objects.using(app.appID)
+            persons = Subject.objects.for_app(app.appID)
             [ person.delete() for person in persons ]  # this will delete the image file
 
             myDBManager.drop_database(app.appID)   #  this will delete the database file
@@ -179,6 +183,7 @@ class AppViewSet(mixins.ListModelMixin,
             shutil.rmtree(face_path)
 
         myDBManager.drop_database(app.appID)
+        gallery_cache.invalidate(app.appID)
         app.is_active = False
         app.save()
 
@@ -198,7 +203,7 @@ class SubjectViewSet(mixins.ListModelMixin,
         app = models.get_target_app(self.request.user, appID=self.request.data['appID'] if 'appID' in self.request.data else None)
         if app==None:
             raise ValidationError({'info': 'App Not Found!', 'error_code': NO_APP_ERROR})
-        return Subject.objects.using(app.appID).all()
+        return Subject.objects.for_app(app.appID).all()
 
     # override to pass generated random ID
     def perform_create(self, serializer):
@@ -215,12 +220,19 @@ class SubjectViewSet(mixins.ListModelMixin,
         self.perform_update(serializer)
         return Response(serializer.data)
 
+    # override to update app's modified_time, the deleted subject leaves the cached galleries
+    def perform_destroy(self, instance):
+        app = models.get_target_app(self.request.user, appID=instance.appID)
+        instance.delete()
+        if app != None:
+            app.save()
+
 
 class FaceViewSet(viewsets.ModelViewSet):
     serializer_class = FaceSerializer
     permission_classes = (permissions.IsAuthenticated, TokenPermission)
     parser_classes = (MultiPartParser, FormParser, JSONParser, FileUploadParser)
-    feature_extractor = extraction.FeatureExtractor()
+    feature_extractor = model_registry.get_extractor()
 
     def get_queryset(self):
         # get the person
@@ -228,14 +240,14 @@ class FaceViewSet(viewsets.ModelViewSet):
         if app==None:
             raise ValidationError({'info': 'App not found!', 'error_code': NO_APP_ERROR})
         
-        subject = Subject.objects.using(app.appID)
+        subject = Subject.objects.for_app(app.appID)
         if 'subjectID' in self.request.data:
             subject = subject.filter(subjectID=self.request.data['subjectID'])
             if len(subject) == 0:
                 raise ValidationError({'info': 'Invalid subject ID', 'error_code': NO_SUBJECT_ERROR})
 
         # get subject's all faces
-        return Face.objects.using(app.appID).filter(subject__in=subject)
+        return Face.objects.for_app(app.appID).filter(subject__in=subject)
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
@@ -248,7 +260,7 @@ class FaceViewSet(viewsets.ModelViewSet):
         if 'subjectID' not in self.request.data:
             raise ValidationError({'info': 'SubjectID is required.', 'error_code': INVALID_REQUEST_ERROR})
 
-        subject = Subject.objects.using(app.appID).filter(subjectID=self.request.data['subjectID'])
+        subject = Subject.objects.for_app(app.appID).filter(subjectID=self.request.data['subjectID'])
 
         if len(subject) != 1: # have and only have one person
             log.error('No person specified!')
@@ -259,20 +271,25 @@ class FaceViewSet(viewsets.ModelViewSet):
             return Response(status=status.HTTP_400_BAD_REQUEST, data={'info': 'Image is required.', 'error_code': NO_IMAGE_ERROR})
 
         try:
-            tmp_image = Image.open(self.request.data['image'])
-            tmp_array = np.array(tmp_image)
-            cv2.cvtColor(tmp_array, cv2.COLOR_RGB2BGR)
+            face_array = decode_image(self.request.data['image'])
             image = self.request.data['image']
-        except:
-            return Response(status=status.HTTP_400_BAD_REQUEST, data={'info': 'Image format error or data corrupted!', 'error_code': IMAGE_FORMAT_ERROR})
+        except ImageError as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'info': str(e), 'error_code': IMAGE_FORMAT_ERROR})
+        # checked before saving, the extraction may only run later
+        if not (tuple(face_array.shape[1::-1]) == tuple(service_settings.face_size)):
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'info': 'Face image has a wrong size' + str(face_array.shape[1::-1]) + '. It should be ' + str(service_settings.face_size) + '.', 'error_code': IMAGE_FORMAT_ERROR})
 
         face = serializer.save(subject=subject[0], image=image)
         subject[0].save() # this will update person's modified_time
         app.save() # this will update app's modified_time
 
-        # calculate known features
-        for name, func in self.feature_extractor.extractors.items():
-            Feature.objects.db_manager(app.appID).create(feature_name=name, face=face, data=json.dumps(self.feature_extractor.extract(Image.open(self.request.data['image']), name).real.tolist()))
+        if service_settings.async_feature_extraction:
+            queue_feature_extraction(request.user, app)
+        else:
+            # calculate the enabled features from the decoded image
+            features = [Feature(feature_name=name, face=face, data=self.feature_extractor.extract_batch([face_array, ], name).real.reshape([-1, 1]))
+                        for name in enabled_features(app)]
+            models.insert_features(app.appID, features)
 
         headers = self.get_success_headers(serializer.data)
         return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
@@ -280,6 +297,45 @@ class FaceViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         serializer.save(image=None if 'image' not in self.request.data else self.request.data['image'])
 
+    @list_route(methods=['post', ])
+    def bulk_upload(self, request):
+        '''
+        Upload the faces of an archive. See company/bulk_upload.py for the manifest.
+        '''
+        app = models.get_target_app(request.user, appID=request.data['appID'] if 'appID' in request.data else None)
+        if app is None:
+            raise ValidationError({'info': 'App Not Found!', 'error_code': NO_APP_ERROR})
+        if 'archive' not in request.data:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'info': 'Archive is required.', 'error_code': INVALID_REQUEST_ERROR})
+
+        try:
+            manifest = request.data.get('manifest')
+            if manifest is not None and hasattr(manifest, 'read'):
+                manifest = manifest.read().decode('utf-8')
+            if manifest is None:
+                manifest = read_archive_manifest(request.data['archive'])
+            if manifest is None:
+                return Response(status=status.HTTP_400_BAD_REQUEST, data={'info': 'Manifest is required.', 'error_code': INVALID_REQUEST_ERROR})
+            reports = BulkFaceUpload(app).run(request.data['archive'], parse_manifest(manifest))
+        except (ManifestError, UnicodeDecodeError) as e:
+            return Response(status=status.HTTP_400_BAD_REQUEST, data={'info': str(e), 'error_code': INVALID_REQUEST_ERROR})
+
+        succeeded = len([report for report in reports if 'imageID' in report])
+        if succeeded != 0:
+            app.save() # this will update app's modified_time
+            if service_settings.async_feature_extraction:
+                queue_feature_extraction(request.user, app)
+        return Response({'succeeded': succeeded, 'failed': len(reports) - succeeded, 'items': reports})
+
+
+def queue_feature_extraction(company, app):
+    '''
+    Queue the extraction of the features of the app's new faces, unless it is already queued.
+    '''
+    serviceID = services.FEATURE_EXTRACTION[0]
+    if not Command.objects.filter(app=app, serviceID=serviceID, status=models.COMMAND_QUEUED).exists():
+        Command.objects.create(company=company, app=app, serviceID=serviceID, status=models.COMMAND_QUEUED, progress=0, arguments='{}')
+
 
 def service_bind(service_config):
     service = service_config[2]()
@@ -290,6 +346,7 @@ def service_bind(service_config):
                 raise ValidationError({'info': 'App Not Found',  'error_code': NO_APP_ERROR})
                         # validation service input
             app = App.objects.filter(appID=request.data['appID'], company=request.user)[0]
+            connection_pool.touch(models.app_database(app.appID))
             is_valid, info = service.is_valid_input_data(request.data, app=app)
             if not is_valid:
                 return Response(status=status.HTTP_400_BAD_REQUEST, data={'info': info})
@@ -342,10 +399,24 @@ class CommandViewSet(mixins.ListModelMixin,
 
     @list_route(methods=['get', ], permission_classes=[TokenPermission, ])
     @service_bind(services.ENROLLMENT)
-    @log_command()
-    def enroll(self, request, service, app):
-        results = service.execute(data=request.data, app=app)
-        log.info("Service: "+services.ENROLLMENT[1])
+    def enroll(self, request, service, serviceID, app):
+        if not service_settings.async_enrollment:
+            Command.objects.create(company=request.user, app=app, serviceID=serviceID)
+            results = service.execute(data=request.data, app=app)
+            log.info("Service: "+services.ENROLLMENT[1])
+            return Response(results)
+
+        # queue the command for the command worker, poll /commands/<id>/ for its progress and results
+        command = Command.objects.create(company=request.user, app=app, serviceID=serviceID, status=models.COMMAND_QUEUED, progress=0,
+                                         arguments=json.dumps(dict(request.data.items())))
+        log.info("Service: "+services.ENROLLMENT[1]+" queued as command %d" % (command.id))
+        serializer = self.get_serializer(command)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @list_route(methods=['get', ], permission_classes=[TokenPermission, ])
+    @service_bind(services.ENROLLMENT)
+    def enroll_progress(self, request, service, serviceID, app):
+        results = service.progress(data=request.data, app=app)
         return Response(results)
 
     @list_route(methods=['post', ], permission_classes=[TokenPermission, ])
@@ -356,6 +427,22 @@ class CommandViewSet(mixins.ListModelMixin,
         log.info("Service: "+services.RECOGNITION[1])
         return Response(results)
 
+    @list_route(methods=['post', ], permission_classes=[TokenPermission, ])
+    @service_bind(services.BATCH_RECOGNITION)
+    @log_command()
+    def recognize_batch(self, request, service, app):
+        results = service.execute(request=request, data=request.data, app=app)
+        log.info("Service: "+services.BATCH_RECOGNITION[1])
+        return Response(results)
+
+    @list_route(methods=['post', ], permission_classes=[TokenPermission, ])
+    @service_bind(services.PIPELINE)
+    @log_command()
+    def detect_recognize(self, request, service, app):
+        results = service.execute(request=request, data=request.data, app=app)
+        log.info("Service: "+services.PIPELINE[1])
+        return Response(results)
+
     @list_route(methods=['post', ], permission_classes=[TokenPermission, ])
     @service_bind(services.COMPARE)
     @log_command()
@@ -0,0 +1,118 @@
+'''
+Approximate nearest neighbor search for very large galleries (inverted file index, pure numpy).
+The templates are clustered by k-means into inverted lists. A probe is only compared with the templates of the
+nprobe lists whose centroids are the nearest, so nprobe is the recall/latency knob: nprobe = number of lists is
+the exact search.
+'''
+
+# service settings
+from . import settings
+# data structure
+import numpy as np
+
+
+class IVFIndex:
+    def __init__(self, centroids, vectors, subjects, offsets):
+        '''
+        :param centroids:
+            the centroids of the inverted lists. (L x d)
+        :param vectors:
+            the templates sorted by list. (N x d)
+        :param subjects:
+            the subject IDs of the templates, in the same order
+        :param offsets:
+            list l holds vectors[offsets[l]:offsets[l + 1]]. (L + 1)
+        '''
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.subjects = np.asarray(subjects)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.squared_norms = np.einsum('ij,ij->i', self.vectors, self.vectors)
+
+    def __len__(self):
+        return len(self.subjects)
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, templates, subjects, n_lists=None, iterations=None, seed=0):
+        '''
+        :param templates:
+            list of template vectors, one per subject
+        :param subjects:
+            list of subject IDs in the same order
+        :param n_lists:
+            the number of inverted lists, sqrt(N) by default
+        :return:
+            the IVFIndex
+        '''
+        X = np.ascontiguousarray(np.vstack([np.reshape(template, [1, -1]) for template in templates]), dtype=np.float32)
+        subjects = np.asarray(subjects)
+
+        if n_lists is None:
+            n_lists = int(np.sqrt(len(X)))
+        n_lists = max(1, min(n_lists, settings.ann_max_lists, len(X)))
+        iterations = settings.ann_kmeans_iterations if iterations is None else iterations
+
+        # k-means
+        random = np.random.RandomState(seed)
+        centroids = X[random.choice(len(X), n_lists, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = _nearest_centroid(X, centroids)
+            for l in range(n_lists):
+                members = X[assignments == l]
+                if len(members) != 0:
+                    centroids[l] = members.mean(axis=0)
+        assignments = _nearest_centroid(X, centroids)
+
+        order = np.argsort(assignments, kind='mergesort')
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignments, minlength=n_lists))])
+        return cls(centroids, X[order], subjects[order], offsets)
+
+    def search(self, probe_feature, k, nprobe=None):
+        '''
+        :param probe_feature:
+            the probe vector
+        :param k:
+            the number of nearest templates
+        :param nprobe:
+            the number of inverted lists to scan, settings.ann_nprobe by default
+        :return:
+            (subjects, distances) of the (approximately) k nearest templates, the nearest first
+        '''
+        probe = np.asarray(probe_feature, dtype=np.float32).reshape([-1])
+        nprobe = settings.ann_nprobe if nprobe is None else nprobe
+        nprobe = max(1, min(nprobe, self.n_lists))
+
+        # the nearest lists
+        centroid_distance = np.einsum('ij,ij->i', self.centroids, self.centroids) - 2 * np.dot(self.centroids, probe)
+        lists = np.argpartition(centroid_distance, nprobe - 1)[:nprobe] if nprobe < self.n_lists else np.arange(self.n_lists)
+
+        candidates = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+        if len(candidates) == 0:
+            return self.subjects[:0], np.zeros(0)
+
+        squared_distance = self.squared_norms[candidates] - 2 * np.dot(self.vectors[candidates], probe) + np.dot(probe, probe)
+        k = min(k, len(candidates))
+        topk = np.argpartition(squared_distance, k - 1)[:k] if k < len(candidates) else np.arange(len(candidates))
+        topk = topk[np.argsort(squared_distance[topk])]
+        return self.subjects[candidates[topk]], np.sqrt(np.maximum(squared_distance[topk], 0))
+
+    def save(self, file):
+        np.savez(file, centroids=self.centroids, vectors=self.vectors, subjects=self.subjects, offsets=self.offsets)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            return cls(data['centroids'], data['vectors'], data['subjects'], data['offsets'])
+
+
+def _nearest_centroid(X, centroids, chunk_size=4096):
+    centroid_norms = np.einsum('ij,ij->i', centroids, centroids)
+    assignments = np.empty(len(X), dtype=np.int64)
+    for start in range(0, len(X), chunk_size):
+        chunk = X[start:start + chunk_size]
+        assignments[start:start + chunk_size] = np.argmin(centroid_norms - 2 * np.dot(chunk, centroids.T), axis=1)
+    return assignments
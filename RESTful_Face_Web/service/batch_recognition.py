@@ -0,0 +1,134 @@
+from .recognition import RecognitionService
+from . import settings
+import numpy as np
+# image
+from .image_ingest import decode_image, ImageError
+# archives
+import zipfile
+import io
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+
+def read_faces(data):
+    '''
+    :param data:
+        'faces' Several face images, or one zip of face images, or one npz of an (N x H x W x 3) uint8 array
+    :return:
+        list of (name, RGB array)
+    :raise ImageError: more than settings.batch_recognition_max_faces faces or settings.batch_recognition_max_bytes,
+        or a npz array that is not uint8 faces of settings.face_size
+    '''
+    files = data.getlist('faces') if hasattr(data, 'getlist') else data['faces']
+    if not isinstance(files, (list, tuple)):
+        files = [files]
+
+    if len(files) == 1 and zipfile.is_zipfile(files[0]):
+        # the archive is read once for the validation and the execution
+        if not hasattr(files[0], '_decoded_faces'):
+            files[0]._decoded_faces = _read_archive(files[0])
+        return files[0]._decoded_faces
+
+    _check_count(len(files))
+    faces = []
+    for index, face_file in enumerate(files):
+        faces.append((getattr(face_file, 'name', str(index)), decode_image(face_file)))
+    return faces
+
+
+def _check_count(count):
+    if count > settings.batch_recognition_max_faces:
+        raise ImageError('Too many face images(%d). At most %d per request.' % (count, settings.batch_recognition_max_faces))
+
+
+def _read_archive(archive_file):
+    archive_file.seek(0)
+    with zipfile.ZipFile(archive_file) as archive:
+        # the limits are checked on the sizes of the zip directory before anything is decompressed,
+        # zipfile does not read more than the declared size of a member
+        members = sorted((info for info in archive.infolist() if not info.filename.endswith('/')), key=lambda info: info.filename)
+        _check_count(len(members))
+        total_size = sum(info.file_size for info in members)
+        if total_size > settings.batch_recognition_max_bytes:
+            raise ImageError('Archive is too large(%d bytes uncompressed). At most %d bytes.' % (total_size, settings.batch_recognition_max_bytes))
+
+        if len(members) != 0 and all(info.filename.endswith('.npy') for info in members):
+            # numpy arrays, never unpickled
+            archive_file.seek(0)
+            with np.load(archive_file, allow_pickle=False) as arrays:
+                faces = []
+                for name in sorted(arrays.files):
+                    faces.extend(('%s[%d]' % (name, index), face) for index, face in enumerate(_face_array(name, arrays[name])))
+                    _check_count(len(faces))
+                return faces
+
+        # face images
+        faces = []
+        for info in members:
+            faces.append((info.filename, decode_image(io.BytesIO(archive.read(info)))))
+        return faces
+
+
+def _face_array(name, array):
+    '''
+    :return: the (N x H x W x 3) faces of an (... x H x W x 3) uint8 array
+    '''
+    shape = (settings.face_size[1], settings.face_size[0], 3)
+    if array.dtype != np.uint8 or array.ndim < 3 or tuple(array.shape[-3:]) != shape:
+        raise ImageError('Array %s is %s%s. It should be uint8 (... x %d x %d x 3) faces.' % (name, str(array.dtype), str(array.shape), shape[0], shape[1]))
+    return np.reshape(array, (-1,) + shape)
+
+
+class BatchRecognitionService(RecognitionService):
+    def is_valid_input_data(self, data=None, app=None):
+        '''
+        :param data:
+            'faces' The face images, see read_faces(). The other options are the ones of /commands/recognize/
+        :return:
+            must contain at most settings.batch_recognition_max_faces face images with the specified size,
+            and at most settings.batch_recognition_max_bytes for an archive
+        '''
+        assert(data is not None)
+        assert(app is not None)
+
+        if 'faces' not in data:
+            return False, '<faces> is required.'
+
+        try:
+            faces = read_faces(data)
+        except ImageError as e:
+            return False, str(e)
+        except Exception:
+            return False, 'Face images wrong format or image data corrupted!'
+
+        if len(faces) == 0:
+            return False, 'No face image found.'
+
+        for name, face in faces:
+            if not (face.ndim == 3 and tuple(face.shape[1::-1]) == tuple(settings.face_size) and face.shape[2] == 3):
+                return False, 'Face image %s has a wrong shape%s. It should be %s RGB.' % (name, str(face.shape), str(settings.face_size))
+
+        # the options shared with /commands/recognize/
+        return self._is_valid_options(data, app)
+
+    def execute(self, *args, **kwargs):
+        assert('data' in kwargs)
+        assert('app' in kwargs)
+
+        app = kwargs['app']
+        options = self._parse_options(kwargs['data'])
+        names, faces = zip(*read_faces(kwargs['data']))
+
+        # all the probes in one pass
+        probe_features = self.extractor.extract_batch(list(faces), options['feature_name']).real
+        log.info('%d probe features of shape %s' % (len(probe_features), str(np.shape(probe_features[0]))))
+
+        results, warning = self._classify(app, probe_features, options)
+        if isinstance(results, dict):
+            return results
+
+        results = {'results': [dict(result, face=name) for name, result in zip(names, results)]}
+        if warning is not None:
+            results['warning'] = warning
+        return results
@@ -5,9 +5,61 @@ from sklearn import svm
 from sklearn.externals import joblib  # serialization
 # data
 import numpy as np
+# nearest neighbor search
+from .gallery import GalleryIndex
+from .ann import IVFIndex
+from .model_cache import classifier_model_cache
 # temporary files
 import tempfile
 
+# np.savez writes a zip archive, the SVMs saved by joblib are pickles
+ZIP_MAGIC = b'PK\x03\x04'
+
+
+class LinearSVM:
+    '''
+    The one-vs-rest weights of a linear SVM. Scoring a probe is one matrix-vector product.
+    '''
+    def __init__(self, coef, intercept, classes):
+        '''
+        :param coef: (classes x d), a single row for 2 classes
+        :param intercept: (classes)
+        :param classes: the subject IDs
+        '''
+        self.coef_ = np.ascontiguousarray(coef, dtype=np.float32)
+        self.intercept_ = np.asarray(intercept, dtype=np.float32)
+        self.classes_ = np.asarray(classes)
+
+    @classmethod
+    def from_estimator(cls, clf):
+        return cls(clf.coef_, clf.intercept_, clf.classes_)
+
+    def decision_function(self, X):
+        # the same shape as SVC.decision_function, 1-D for 2 classes
+        distance = np.dot(np.asarray(X, dtype=np.float32), self.coef_.T) + self.intercept_
+        return distance[:, 0] if len(self.intercept_) == 1 else distance
+
+    def save(self, file):
+        np.savez(file, coef=self.coef_, intercept=self.intercept_, classes=self.classes_)
+
+    @classmethod
+    def load(cls, file):
+        with np.load(file) as data:
+            return cls(data['coef'], data['intercept'], data['classes'])
+
+
+def load_svm(file):
+    '''
+    :param file: the opened parameter file of an SVM model
+    :return: the LinearSVM, or the SVC of the models trained before the linear fast path
+    '''
+    magic = file.read(len(ZIP_MAGIC))
+    file.seek(0)
+    if magic == ZIP_MAGIC:
+        return LinearSVM.load(file)
+    return joblib.load(file)
+
+
 class Classifier():
     _classifiers = {}
     _trainers = {}
@@ -16,17 +68,30 @@ class Classifier():
         self._classifiers[settings.nearest_neighbor_name] = self._nearest_neighbor
         self._classifiers[settings.svm_name] = self._svm
         self._classifiers[settings.naive_bayes_name] = self._naive_bayes
+        self._classifiers[settings.ann_name] = self._ann
         self._classifiers['DEFAULT'] = self._default
 
         self._trainers[settings.svm_name] = self._train_svm
+        self._trainers[settings.ann_name] = self._train_ann
+
+    def classify(self, probe_feature, classifier_name='DEFAULT', k=1, model=None, gallery=None, threshold=None, **options):
+        return self._classifiers[classifier_name](gallery, probe_feature, k, model, threshold, **options)
 
-    def classify(self, probe_feature, classifier_name='DEFAULT', k=1, model=None, gallery=None, threshold=None):
-        return self._classifiers[classifier_name](gallery, probe_feature, k, model, threshold)
+    def classify_batch(self, probe_features, classifier_name='DEFAULT', k=1, model=None, gallery=None, threshold=None, **options):
+        '''
+        Classify many probes. The nearest neighbor classifiers score all of them with one matrix product.
+        param: probe_features. (N x d)
+        return: list of results, one per probe.
+        '''
+        if classifier_name in [settings.nearest_neighbor_name, 'DEFAULT']:
+            return self._nearest_neighbor_batch(gallery, probe_features, k, model, threshold)
+        return [self.classify(np.reshape(probe_feature, [-1, 1]), classifier_name, k, model=model, gallery=gallery, threshold=threshold, **options)
+                for probe_feature in probe_features]
 
     def train(self, gallery, classifier_name):
         '''
         Train a classifier.
-        param: gallery. Contain features and subjects.
+        param: gallery. Contain features and subjects (one per face), templates and template_subjects (one per subject).
         param: classifier_name.
         return: a opened file instance representing the model. Typically, use temporary file.
         '''
@@ -34,30 +99,41 @@ class Classifier():
         return self._trainers[classifier_name](gallery)
 
     def _train_svm(self, gallery):
-        features = [f.reshape(-1) for f in gallery['features']]
+        features = np.vstack([f.reshape([1, -1]) for f in gallery['features']])
         labels = gallery['subjects']
 
-        clf = svm.SVC(C=settings.svm_c, kernel=settings.svm_kernel, probability=True, decision_function_shape='ovr')
-
         assert( len(np.unique(labels)) >= 2 )
 
-        clf.fit(features, labels)
+        tmpfile = tempfile.TemporaryFile(mode='w+b')
+        if settings.svm_kernel == 'linear':
+            # primal one-vs-rest solver (n_samples >> n_features), saved as the weight matrix
+            clf = svm.LinearSVC(C=settings.svm_c, dual=False)
+            clf.fit(features, labels)
+            LinearSVM.from_estimator(clf).save(tmpfile)
+        else:
+            clf = svm.SVC(C=settings.svm_c, kernel=settings.svm_kernel, probability=True, decision_function_shape='ovr')
+            clf.fit(features, labels)
+            joblib.dump(clf, tmpfile)
+
+        return tmpfile
+
+    def _train_ann(self, gallery):
+        index = IVFIndex.build(gallery['templates'], gallery['template_subjects'])
 
         tmpfile = tempfile.TemporaryFile(mode='w+b')
-        joblib.dump(clf, tmpfile)
+        index.save(tmpfile)
 
         return tmpfile
 
-    def _svm(self, gallery, probe_feature, k, model, threshold):
+    def _svm(self, gallery, probe_feature, k, model, threshold, **options):
         assert(gallery is None)
 
         if model is None:
-            return {'info': 'SVM classifier not found. Please train it using /commands/enroll/ .', 'error_code': settings.NO_CLASSIFIAR_ERROR}
+            return {'info': 'SVM classifier not found. Please train it using /commands/enroll/ .', 'error_code': settings.NO_CLASSIFIER_ERROR}
 
-        clf = joblib.load(model.parameter_file)
-        model.parameter_file.close()
+        clf = classifier_model_cache.get(model, load_svm)
 
-        distance = clf.decision_function([probe_feature[:, 0].tolist(), ])
+        distance = clf.decision_function(np.reshape(probe_feature, [1, -1]))
 
         if len(np.shape(distance)) == 1:
             if k == 1:
@@ -70,17 +146,45 @@ class Classifier():
         return { 'subjectID': clf.classes_[topk_indices], 'distance': np.array(distance[0])[topk_indices].tolist() } # if retrain, then save the new model
 
 
-    def _nearest_neighbor(self, gallery, probe_feature, k, model, threshold):
-        # the gallery should be the list of template, the vector of mean feature
+    def _ann(self, gallery, probe_feature, k, model, threshold, nprobe=None, **options):
+        assert(gallery is None)
+
+        if model is None:
+            return {'info': 'ANN index not found. Please build it using /commands/enroll/ .', 'error_code': settings.NO_CLASSIFIER_ERROR}
+
+        index = classifier_model_cache.get(model, IVFIndex.load)
+
+        subjects, distance = index.search(probe_feature, k, nprobe=nprobe)
+
+        result = {'subjectID': subjects.tolist(), 'distance': distance.tolist()}
+        return self._apply_threshold(result, threshold)
+
+    def _nearest_neighbor(self, gallery, probe_feature, k, model, threshold, **options):
+        # the gallery should be the GalleryIndex of templates (or the list of template, the vector of mean feature)
+        assert(model is None)
+        assert(gallery is not None)
+
+        if not isinstance(gallery, GalleryIndex):
+            gallery = GalleryIndex(gallery['templates'], gallery['subjects'])
+
+        topk_indices, distance = gallery.search(probe_feature, k)
+
+        result = {'subjectID': gallery.subjects[topk_indices].tolist(), 'distance': distance.tolist()}
+        return self._apply_threshold(result, threshold)
+
+    def _nearest_neighbor_batch(self, gallery, probe_features, k, model, threshold):
         assert(model is None)
         assert(gallery is not None)
 
-        distance = [ np.linalg.norm(template.reshape([-1, 1]) - probe_feature.reshape([-1, 1])) for template in gallery['templates']]
+        if not isinstance(gallery, GalleryIndex):
+            gallery = GalleryIndex(gallery['templates'], gallery['subjects'])
 
-        topk_indices = np.argsort(distance)[:k]
+        topk_indices, distance = gallery.search_batch(probe_features, k)
 
-        result = {'subjectID': np.array(gallery['subjects'])[topk_indices].tolist(), 'distance': np.array(distance)[topk_indices].tolist()}
+        return [self._apply_threshold({'subjectID': gallery.subjects[indices].tolist(), 'distance': probe_distance.tolist()}, threshold)
+                for indices, probe_distance in zip(topk_indices, distance)]
 
+    def _apply_threshold(self, result, threshold):
         # the threshold only support openface embeddings with nearest neighbor classifier
         if threshold is None:
             return result
@@ -91,9 +195,9 @@ class Classifier():
 
         return result
 
-    def _naive_bayes(self, gallery, probe_feature, k, model, threshold):
+    def _naive_bayes(self, gallery, probe_feature, k, model, threshold, **options):
         pass
 
 
-    def _default(self, gallery, probe_feature, k, model, threshold):
-        return self._nearest_neighbor(gallery, probe_feature, k, model, threshold)
+    def _default(self, gallery, probe_feature, k, model, threshold, **options):
+        return self._nearest_neighbor(gallery, probe_feature, k, model, threshold, **options)
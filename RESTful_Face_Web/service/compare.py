@@ -1,12 +1,10 @@
 from .base_service import BaseService
-from PIL import Image
+from .image_ingest import decode_image, ImageError
 from . import settings
 # feature
-from .recognition import FeatureExtractor
+from . import model_registry
 # math
 from numpy import linalg
-import numpy as np
-import cv2
 
 
 class CompareService(BaseService):
@@ -20,16 +18,12 @@ class CompareService(BaseService):
             return False, 'Field <face2> is required.'
 
         try: 
-            face1 = Image.open(data['face1'])
-            face2 = Image.open(data['face2'])
-            face1_array = np.array(face1)
-            face2_array = np.array(face2)
-            cv2.cvtColor(face1_array, cv2.COLOR_RGB2BGR)
-            cv2.cvtColor(face2_array, cv2.COLOR_RGB2BGR)
-        except:
-            return False, 'Face image wrong format or image data corrupted!'
+            face1_array = decode_image(data['face1'])
+            face2_array = decode_image(data['face2'])
+        except ImageError as e:
+            return False, str(e)
 
-        if not (tuple(face1.size) == tuple(settings.face_size) and tuple(face2.size) == tuple(settings.face_size)):
+        if not (tuple(face1_array.shape[1::-1]) == tuple(settings.face_size) and tuple(face2_array.shape[1::-1]) == tuple(settings.face_size)):
             return False, 'Face image has a wrong size. It should be '+ str(settings.face_size) + '.'
 
         if 'threshold' in data and data['threshold'].lower() not in ['l', 'm', 'h']:
@@ -47,10 +41,10 @@ class CompareService(BaseService):
         if 'threshold' in data:
             threshold = settings.openface_NN_Threshold[data['threshold'].upper()]
 
-        extractor = FeatureExtractor()
+        extractor = model_registry.get_extractor()
 
-        face1 = Image.open(data['face1'])
-        face2 = Image.open(data['face2'])
+        face1 = decode_image(data['face1'])
+        face2 = decode_image(data['face2'])
 
         feature1 = extractor.extract(face1, 'DEFAULT')
         feature2 = extractor.extract(face2, 'DEFAULT')
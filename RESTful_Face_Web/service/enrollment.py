@@ -1,26 +1,25 @@
 # base class
 from .base_service import BaseService
-from company.models import Subject, Face, Feature, FeatureTemplate, ClassifierModel
-# image operation
-from PIL import Image
+from company.models import Subject, Face, Feature, FeatureTemplate, ClassifierModel, app_database
 # service settings
 from . import settings
 # feature
-from .extraction import FeatureExtractor
+from . import model_registry
 # classification
 from .classification import Classifier
+from .gallery import gallery_cache
+# feature backfill
+from .feature_extraction import get_face_features
 # math
 from numpy import linalg
-import json
 import numpy as np
-from functools import reduce
 from sklearn.externals import joblib
 from django.core.files import File
 from django.utils import timezone
 
 
 class EnrollmentService(BaseService):
-    extractor = FeatureExtractor()
+    extractor = model_registry.get_extractor()
     classifier = Classifier()
 
     def is_valid_input_data(self, data=None, app=None):
@@ -35,6 +34,21 @@ class EnrollmentService(BaseService):
         return True, ''
 
 
+    def progress(self, *args, **kwargs):
+        '''
+        :return: how many faces of the app have the feature extracted
+        '''
+        app = kwargs['app']
+        data = kwargs['data']
+
+        feature_name = 'DEFAULT'
+        if 'feature' in data:
+            feature_name = data['feature'].upper()
+
+        total = Face.objects.for_app(app.appID).count()
+        extracted = Feature.objects.for_app(app.appID).filter(feature_name=feature_name).values('face_id').distinct().count()
+        return {'feature': feature_name, 'faces': total, 'extracted': extracted, 'progress': 1.0 if total == 0 else extracted / total}
+
     def execute(self, *args, **kwargs):
         app = kwargs['app']
         data = kwargs['data']
@@ -47,53 +61,41 @@ class EnrollmentService(BaseService):
         if 'classifier' in data:
             classifier_name = data['classifier'].upper()
 
-        subjects = Subject.objects.using(app.appID).all()
-
-        gallery = {'features': [], 'subjects': []}
-        is_updated = False
-        for subject in subjects:
-            # get subject's avaliable templates and faces
-            template = subject.templates.all().filter(feature_name=feature_name)
-            faces = subject.faces.all()
-
-            if len(faces) == 0:
-                continue
-
-            # get feature of each face to append the gallery
-            temp = []
-            for face in faces:
-                feature_data = self._get_face_feature(app.appID, face, feature_name)
-                temp.append(feature_data.reshape([-1, 1]))
-            gallery['features'].extend(temp)
-            gallery['subjects'].extend(np.repeat(subject.subjectID, len(faces)) )
-
-            # check if template exists and is valid
-            assert(len(template)<=1)
-            if len(template) == 1 and template[0].modified_time > subject.modified_time:
-                continue
+        # only subjects with faces uploaded after their template was updated are touched
+        subjects = Subject.objects.for_app(app.appID).only('id', 'subjectID', 'modified_time')
+        templates = dict((template.subject_id, template) for template in FeatureTemplate.objects.for_app(app.appID).filter(feature_name=feature_name))
 
-            # there are some new face image uploaded
-            is_updated = True
+        stale_subjects = [subject for subject in subjects
+                          if subject.id not in templates or templates[subject.id].modified_time <= subject.modified_time]
 
-            template, created = FeatureTemplate.objects.db_manager(app.appID).get_or_create(feature_name=feature_name, subject=subject)
-            print('created: ', created)
+        # the queued command reports the fraction of the stale subjects done, every 1% (one update of the command)
+        progress = kwargs.get('progress')
+        progress_step = max(1, len(stale_subjects) // 100)
 
-            num  = len(temp)
-            template_data = reduce(lambda x, y: x + y, temp) / num
+        is_updated = False
+        for index, subject in enumerate(stale_subjects):
+            # there are some new face image uploaded
+            if self._update_template(app.appID, subject, templates.get(subject.id), feature_name):
+                is_updated = True
+            if progress is not None and ((index + 1) % progress_step == 0 or index + 1 == len(stale_subjects)):
+                progress((index + 1) / len(stale_subjects))
 
-            template.data = json.dumps(template_data.real.tolist())
-            template.save()
-            print(template.modified_time)
+        # bump the version stamp of the cached galleries
+        if is_updated:
+            # only the stamp, the app may have been edited or deleted while enrolling
+            app.save(update_fields=['update_time'])
+            gallery_cache.invalidate(app.appID)
 
         # if the classification need training
         if classifier_name in settings.need_training_classifiers:
-            classifier_model, created = ClassifierModel.objects.db_manager(app.appID).get_or_create(appID=app.appID, feature_name=feature_name, classifier_name=classifier_name)
+            classifier_model, created = ClassifierModel.objects.for_app(app.appID).get_or_create(appID=app.appID, feature_name=feature_name, classifier_name=classifier_name)
             
             # check if the classification model is outdated
             if not created and classifier_model.modified_time > app.update_time:
                 assert(is_updated==False)
                 return {'Updated time': timezone.localtime(classifier_model.modified_time)}
 
+            gallery = self._get_gallery(app.appID, feature_name)
             if len(np.unique(gallery['subjects'])) < 2:
                 return {'info': 'At least, you need to have 2 subjects enrolled with at least one face iamge.', 'error_code': settings.NOT_ENOUGH_SUBJECT_ERROR}
 
@@ -106,13 +108,56 @@ class EnrollmentService(BaseService):
         return {'Updated time': timezone.localtime(app.update_time)}
         
             
-    def _get_face_feature(self, appID, face, feature_name):
-        result = face.features.filter(feature_name=feature_name)
-        if len(result) == 0:  # if not found, calculate and save
-            with Image.open(face.image) as face_image:
-                result = self.extractor.extract(face_image, name=feature_name).real
-                face.image.close()
-            Feature.objects.db_manager(appID).create(face=face, feature_name=feature_name, data=json.dumps(result.tolist()))
-        else:  # if found, read
-            result = np.array(json.loads(result[0].data))
-        return result # numpy ndarray
+    def _update_template(self, appID, subject, template, feature_name):
+        '''
+        Update the template of the subject. The template keeps the sum of its faces' features, so only the faces newer
+        than the template are added to it. If some face has been deleted since, the template is computed again.
+        :return: True if the template is updated
+        '''
+        faces = list(subject.faces.all().order_by('id'))
+        if len(faces) == 0:
+            return False
+
+        new_faces = faces
+        feature_sum = None
+        if template is not None and template.feature_sum is not None:
+            newer = [face for face in faces if face.id > template.last_face_id]
+            if template.face_count + len(newer) == len(faces):
+                new_faces = newer
+                feature_sum = template.feature_sum
+
+        for feature_data in self._get_face_features(appID, new_faces, feature_name):
+            feature_sum = feature_data.reshape([-1, 1]) if feature_sum is None else feature_sum + feature_data.reshape([-1, 1])
+
+        if template is None:
+            template = FeatureTemplate(feature_name=feature_name, subject=subject)
+        template.feature_sum = feature_sum.real
+        template.face_count = len(faces)
+        template.last_face_id = faces[-1].id
+        template.data = feature_sum.real / len(faces)
+        template.save(using=app_database(appID))
+        return True
+
+    def _get_gallery(self, appID, feature_name):
+        '''
+        :return: the gallery to train classifiers, the features of all faces and the templates of all subjects
+        '''
+        # features of faces which have never been extracted
+        missing = list(Face.objects.for_app(appID).exclude(features__feature_name=feature_name))
+        if len(missing) != 0:
+            self._get_face_features(appID, missing, feature_name)
+
+        gallery = {'features': [], 'subjects': [], 'templates': [], 'template_subjects': []}
+        for subjectID, feature_data in Feature.objects.for_app(appID).filter(feature_name=feature_name).values_list('face__subject__subjectID', 'data'):
+            gallery['features'].append(feature_data.reshape([-1, 1]))
+            gallery['subjects'].append(subjectID)
+        for subjectID, template_data in FeatureTemplate.objects.for_app(appID).filter(feature_name=feature_name).values_list('subject__subjectID', 'data'):
+            gallery['templates'].append(template_data)
+            gallery['template_subjects'].append(subjectID)
+        return gallery
+
+    def _get_face_features(self, appID, faces, feature_name):
+        '''
+        :return: list of numpy ndarray, the features of the faces in the same order, missing ones are calculated and saved
+        '''
+        return get_face_features(appID, faces, feature_name)
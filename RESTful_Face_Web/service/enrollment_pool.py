@@ -0,0 +1,78 @@
+'''
+Process pool to backfill a feature of many faces during enrollment.
+The faces are split into shards, each worker process loads its own models once (model_registry) and extracts its
+shards in batches, and the parent inserts the Feature rows of each finished shard with one bulk_create.
+The progress is visible to /commands/enroll_progress/ as soon as a shard is inserted.
+'''
+
+# service settings
+from . import settings
+from . import model_registry
+from company.models import Feature, insert_features
+# image, decoded as at the upload
+from .image_ingest import decode_image
+# processes
+import multiprocessing
+from django.db import connections
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+
+def pool_available():
+    '''
+    The pool is only forked outside uwsgi, e.g. by the command worker: a uwsgi worker holds the sockets of its
+    requests, its database connections and the pipes of the openface net.
+    '''
+    try:
+        import uwsgi
+    except ImportError:
+        return True
+    return False
+
+
+def _init_worker():
+    # the forked process must load its own torch net instead of sharing the pipes of the parent's one
+    model_registry.reset()
+
+
+def _extract_shard(task):
+    feature_name, shard = task
+
+    face_arrays = []
+    for face_id, path in shard:
+        face_arrays.append(decode_image(path))
+    features = model_registry.get_extractor().extract_batch(face_arrays, feature_name).real
+
+    return [(face_id, feature_data.reshape([-1, 1])) for (face_id, path), feature_data in zip(shard, features)]
+
+
+class FeatureBackfill:
+    def __init__(self, processes=None, shard_size=None):
+        self.processes = settings.enrollment_processes if processes is None else processes
+        self.shard_size = settings.enrollment_shard_size if shard_size is None else shard_size
+
+    def run(self, appID, faces, feature_name):
+        '''
+        Extract and save the feature of the faces.
+        :param appID: the database of the faces
+        :param faces: list of Face
+        :param feature_name: the feature to extract
+        :return: {face id: feature}
+        '''
+        faces = dict((face.id, face) for face in faces)
+        items = [(face.id, face.image.path) for face in faces.values()]
+        tasks = [(feature_name, items[start:start + self.shard_size]) for start in range(0, len(items), self.shard_size)]
+
+        # the forked processes must not inherit the open database connections
+        connections.close_all()
+
+        results = {}
+        with multiprocessing.Pool(self.processes, initializer=_init_worker) as pool:
+            for shard_results in pool.imap_unordered(_extract_shard, tasks):
+                saved = insert_features(appID, [Feature(face=faces[face_id], feature_name=feature_name, data=feature_data)
+                                                for face_id, feature_data in shard_results])
+                results.update(shard_results)
+                results.update((face_id, data) for (face_id, name), data in saved.items())
+                log.info('App %s: %d/%d features %s extracted.' % (appID, len(results), len(items), feature_name))
+        return results
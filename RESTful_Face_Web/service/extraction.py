@@ -1,6 +1,7 @@
 '''
 This file is to extract feature from an instance of Image class (PIL package).
 Only need 2 input: image instance and feature name
+A list of faces can be extracted at once with extract_batch, which returns one feature per row.
 The feature name can be one of {PCA, LDA, HOG, LBP} or left to be default which is extracted by Openface model.
 '''
 
@@ -13,11 +14,19 @@ from PIL import Image
 # lbp feature
 from skimage.feature import local_binary_pattern
 import skimage
-import openface
 import cv2
+# pca, lda projection
+from .projection import load_projection
+# shared torch net
+from . import model_registry
+# batch forward through the torch net
+import tempfile
+import shutil
+import os
 
 class FeatureExtractor:
     extractors = {}
+    batch_extractors = {}
 
     def __init__(self):
         self.extractors[settings.pca_name] = self._pca
@@ -25,12 +34,11 @@ class FeatureExtractor:
         self.extractors[settings.hog_name] = self._hog
         self.extractors[settings.lbp_name] = self._lbp
         self.extractors[settings.default_name] = self._default
-        self.pca_mean = None
-        self.pca_w = None
-        self.lda_mean = None
-        self.lda_w = None
-        self.lbp_w = None
-        self.openface_nn = None
+
+        self.batch_extractors[settings.pca_name] = self._pca_batch
+        self.batch_extractors[settings.lda_name] = self._lda_batch
+        self.batch_extractors[settings.lbp_name] = self._lbp_batch
+        self.batch_extractors[settings.default_name] = self._default_batch
 
     def extract(self, face, name):
         '''
@@ -44,37 +52,46 @@ class FeatureExtractor:
         '''
         return self.extractors[name](face)
 
-    def _pca(self, face):
-        assert (face.size == settings.face_size)
-        face_array = np.array(face.convert('L'))
-        face.close()
+    def extract_batch(self, faces, name):
+        '''
+        This is the public interface to extract features of many faces at once
+        :param faces:
+            list of Image objects (or RGB arrays) of cropped valid faces
+        :param name:
+            the method the extractor uses
+        :return:
+            the feature matrix with one row per face. (N x feature dimension)
+        '''
+        if len(faces) == 0:
+            return np.zeros([0, 0])
+        if name in self.batch_extractors:
+            return self.batch_extractors[name](faces)
+        return np.vstack([self.extract(face, name).reshape([1, -1]) for face in faces])
 
-        if self.pca_mean is None:
-            print('open pca mean')
-            self.pca_mean = np.load(settings.pca_mean_path)
-        if self.pca_w is None:
-            print('open pca w')
-            self.pca_w = np.load(settings.pca_w_path)[:, :settings.pca_k]
-        feature = np.dot(self.pca_w.T, face_array.reshape([-1, 1]) - self.pca_mean)  # 206 x 1
-        return feature
+    def _pca(self, face):
+        return self._pca_batch([face, ]).reshape([-1, 1])  # 206 x 1
 
+    def _pca_batch(self, faces):
+        return load_projection(settings.pca_name).project(_stack_gray(faces))  # N x 206
 
     def _lda(self, face):
-        assert(face.size == settings.face_size)
-        face_array = np.array(face.convert('L'))
-        face.close()
+        return self._lda_batch([face, ]).reshape([-1, 1])  # 257 x 1
 
-        if self.lda_mean is None:
-            self.lda_mean = np.load(settings.lda_mean_path)
-        if self.lda_w is None:
-            self.lda_w  = np.load(settings.lda_w_path)
-        feature = np.dot(self.lda_w.T, face_array.reshape([-1, 1]) - self.lda_mean)  # 257 x 1
-        return feature
+    def _lda_batch(self, faces):
+        return load_projection(settings.lda_name).project(_stack_gray(faces))  # N x 257
 
     def _lbp(self, face):
-        assert(face.size == settings.face_size)
-        face_array = np.array(face.convert('L'))
-        face.close()
+        return self._lbp_batch([face, ]).reshape([-1, 1])  # 257 x 1
+
+    def _lbp_batch(self, faces):
+        descriptors = np.vstack([self._lbp_descriptor(face).reshape([1, -1]) for face in faces])  # N x 3480
+
+        # use lda to do dimensionality reduction
+        return load_projection(settings.lbp_name).project(descriptors)  # N x 257
+
+    def _lbp_descriptor(self, face):
+        face_array = _to_array(face, 'L')
+        assert(face_array.shape == settings.face_size)
 
         # extract lbp descriptor
         [per_width, per_height] = [int(settings.face_size[0] / settings.lbp_regions_num[0]),
@@ -86,32 +103,89 @@ class FeatureExtractor:
 
         bin_range = int(np.ceil(np.max(patterns)))
         hists = [np.histogram(pattern.ravel(), bins=bin_range)[0] for pattern in patterns]  # ? normalize
-        feature = np.vstack(hists).reshape([-1, 1])  # row - region , column - labels
-
-        # use lda to do dimensionality reduction
-        if self.lbp_w is None:
-            self.lbp_w = np.load(settings.lbp_lda_w_path)
-        feature = np.dot(self.lbp_w.T, feature)  # 257 x 1
-        return feature
+        return np.vstack(hists).reshape([-1, 1])  # row - region , column - labels
 
     def _hog(self, face):
-        assert(face.size == settings.face_size)
-        face_array = np.array(face.convert('L'))
-        face.close()
+        face_array = _to_array(face, 'L')
+        assert(face_array.shape == settings.face_size)
 
         hog = skimage.feature.hog(face_array, orientations=settings.hog_ori, pixels_per_cell=settings.hog_cell, cells_per_block=settings.hog_region)
 
         return hog.reshape([-1, 1])  # 288 x 1
 
     def _default(self, face):
-        assert(face.size == settings.face_size)
-        face_array = np.array(face)
-        face.close()
-
-        if self.openface_nn is None:
-            self.openface_nn = openface.TorchNeuralNet(settings.openface_model_path, imgDim=settings.openface_imgDim)
+        face_array = _to_array(face, 'RGB')
+        assert(face_array.shape[:2] == settings.face_size)
 
         alignedFace = cv2.resize(face_array, (settings.openface_imgDim, settings.openface_imgDim))
-        rep = self.openface_nn.forward(alignedFace)
+        rep = model_registry.get_openface_net().forward(alignedFace)
         return rep.reshape([-1, 1])
 
+    def _default_batch(self, faces):
+        face_arrays = [_to_array(face, 'RGB') for face in faces]
+        assert(all(face_array.shape[:2] == settings.face_size for face_array in face_arrays))
+
+        # N x imgDim x imgDim x 3
+        alignedFaces = np.stack([cv2.resize(face_array, (settings.openface_imgDim, settings.openface_imgDim)) for face_array in face_arrays])
+
+        reps = []
+        for start in range(0, len(alignedFaces), settings.openface_batch_size):
+            reps.extend(self._forward_batch(alignedFaces[start:start + settings.openface_batch_size]))
+        return np.vstack(reps)  # N x 128
+
+    def _forward_batch(self, alignedFaces):
+        '''
+        The torch net lives in a lua subprocess which reads one image path per line and answers one representation
+        per line. Write the whole batch to the pipe at once, then read all the answers, instead of waiting for a
+        round trip per face. The batch has to be small enough for both pipes' buffers (see openface_batch_size).
+        '''
+        openface_nn = model_registry.get_openface_net()
+        if not hasattr(openface_nn, 'p'):
+            return [openface_nn.forward(alignedFace).reshape([1, -1]) for alignedFace in alignedFaces]
+
+        tmp_dir = tempfile.mkdtemp(prefix='openface-batch-')
+        try:
+            paths = []
+            for i, alignedFace in enumerate(alignedFaces):
+                path = os.path.join(tmp_dir, '%d.png' % (i))
+                cv2.imwrite(path, cv2.cvtColor(alignedFace, cv2.COLOR_RGB2BGR))
+                paths.append(path)
+
+            openface_nn.p.stdin.write('\n'.join(paths) + '\n')
+            openface_nn.p.stdin.flush()
+
+            reps = []
+            for _ in paths:
+                output = openface_nn.p.stdout.readline()
+                reps.append(np.array([float(x) for x in output.strip().split(',')]).reshape([1, -1]))
+            return reps
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def _stack_gray(faces):
+    '''
+    :return: the gray faces flattened into a data matrix. (N x pixels)
+    '''
+    face_arrays = [_to_array(face, 'L') for face in faces]
+    assert(all(face_array.shape == settings.face_size for face_array in face_arrays))
+    return np.vstack([face_array.reshape([1, -1]) for face_array in face_arrays])
+
+
+def _to_array(face, mode):
+    '''
+    :param face:
+        Image object or numpy array of the face. The Image object is closed after conversion.
+    :param mode:
+        'RGB' or 'L'
+    :return:
+        numpy array of the face in the given mode
+    '''
+    if isinstance(face, np.ndarray):
+        if mode == 'L' and face.ndim == 3:
+            return np.array(Image.fromarray(face).convert('L'))
+        return face
+    face_array = np.array(face.convert(mode))
+    face.close()
+    return face_array
+
@@ -3,116 +3,208 @@ from .base_service import BaseService
 from PIL import Image
 # face detection
 import dlib
+import cv2
 # data structure
 import numpy as np
+# face payload
+import base64
+import io
 # math and geometry
 import math
 # global settings
 from . import settings
-# try openface detection
-import openface
+# shared detector, aligner and extractor
+from . import model_registry
+# decode the upload once
+from .image_ingest import decode_image, original_size, ImageError
 
 class FaceAligner():
-    def __init__(self, dest_sz, offset_pct):
+    '''
+    Align a face by its eyes: one rotation-scale-translation matrix maps the eye centers to their place in the
+    output, and a single cv2.warpAffine samples the face straight from the image.
+    It has the interface of openface.AlignDlib, see settings.face_aligner.
+    '''
+    def __init__(self, dest_sz, offset_pct, predictor=None):
         self.ler = [36, 42]  # left eye range
         self.rer = [42, 48]  # right eye range
 
         self.dest_sz = np.array(dest_sz)
         self.offset_pct = np.array(offset_pct)
-
-        self.ref_dist = dest_sz[0] * (1 - 2 * offset_pct[0])
-
-    def __affine_rotate(self, image, angle, center, resample=Image.BICUBIC):
-        if center is None:
-            image.rotate(angle=angle, resample=resample)
-        (x0, y0) = center
-        cosine = math.cos(angle)
-        sine = math.sin(angle)
-        a = cosine
-        b = sine
-        c = x0 - x0 * cosine - y0 * sine
-        d = - sine
-        e = cosine
-        f = x0 * sine + y0 - y0 * cosine
-        return image.transform(image.size, Image.AFFINE, (a, b, c, d, e, f), resample=resample)
-
-    def align(self, image, landmarks):
-        # find the eye
-        left_eye = [landmarks[i] for i in range(self.ler[0], self.ler[1])]
-        right_eye = [landmarks[i] for i in range(self.rer[0], self.rer[1])]
-
-        # find the centroid of eyes
-        lec = np.sum(left_eye, axis=0) / len(left_eye)
-        rec = np.sum(right_eye, axis=0) / len(right_eye)
-
-        # find the angle
-        angle = - math.atan2(float(rec[1] - lec[1]), float(rec[0] - lec[0]))
-
-        # find scale
-        dis = np.sqrt(np.sum(np.array(lec - rec) ** 2))
-        scale = dis / self.ref_dist
-
-        # rotate the face
-        rotated_image = self.__affine_rotate(image, angle, center=lec)
-
-        # find the actual crop location
-        crop_xy = (lec[0] - scale * self.dest_sz[0] * self.offset_pct[0], lec[1] - scale * self.dest_sz[1] * self.offset_pct[1])
-        crop_sz = self.dest_sz * scale
-
-        # crop the face from origin image
-        face = rotated_image.crop(
-            (int(crop_xy[0]), int(crop_xy[1]), int(crop_xy[0] + crop_sz[0]), int(crop_xy[1] + crop_sz[1])))
-        resize_face = face.resize(self.dest_sz, Image.BICUBIC)
-
-        return resize_face
+        self.predictor = predictor
+
+    def landmarks(self, rgbImg, bb):
+        shape = self.predictor(rgbImg, bb)
+        return np.array([(part.x, part.y) for part in shape.parts()], dtype=np.float64)
+
+    def transform(self, landmarks, dest_sz=None):
+        '''
+        :param landmarks: the 68 landmarks. (68 x 2)
+        :return: the 2 x 3 affine matrix from the image to the aligned face
+        '''
+        dest_sz = self.dest_sz if dest_sz is None else np.array(dest_sz)
+        landmarks = np.asarray(landmarks, dtype=np.float64)
+
+        # the centroid of eyes
+        lec = landmarks[self.ler[0]:self.ler[1]].mean(axis=0)
+        rec = landmarks[self.rer[0]:self.rer[1]].mean(axis=0)
+
+        # rotate the eyes horizontal, scale their distance to the reference one
+        dx, dy = rec - lec
+        scale = dest_sz[0] * (1 - 2 * self.offset_pct[0]) / max(np.hypot(dx, dy), 1e-6)
+        angle = math.atan2(dy, dx)
+        a, b = scale * math.cos(angle), scale * math.sin(angle)
+
+        # the left eye goes to its offset in the face
+        dest_lec = dest_sz * self.offset_pct
+        return np.array([[a, b, dest_lec[0] - a * lec[0] - b * lec[1]],
+                         [-b, a, dest_lec[1] + b * lec[0] - a * lec[1]]])
+
+    def align(self, imgDim, rgbImg, bb=None, landmarks=None):
+        '''
+        :param imgDim: the size of the aligned face
+        :param rgbImg: the RGB image array
+        :param bb: the dlib rectangle of the face
+        :param landmarks: the 68 landmarks, found in bb by default
+        :return: the aligned face array (imgDim x imgDim x 3)
+        '''
+        if landmarks is None:
+            landmarks = self.landmarks(rgbImg, bb)
+        return cv2.warpAffine(rgbImg, self.transform(landmarks, (imgDim, imgDim)), (imgDim, imgDim), flags=cv2.INTER_LINEAR)
+
+    def align_all(self, imgDim, rgbImg, bbs):
+        '''
+        :return: the aligned faces of all the rectangles
+        '''
+        return [self.align(imgDim, rgbImg, bb=bb) for bb in bbs]
+
+def encode_face(face, face_format='LIST'):
+    '''
+    :param face: the aligned RGB face array
+    :param face_format: one of settings.face_formats
+    :return: the fields of the face in the response
+    '''
+    face = np.ascontiguousarray(face, dtype=np.uint8)
+    if face_format == 'RAW':
+        return {'data': base64.b64encode(face.tobytes()).decode('ascii'), 'shape': list(face.shape), 'dtype': 'uint8'}
+    if face_format in ['PNG', 'JPEG']:
+        buffer = io.BytesIO()
+        options = {'quality': settings.face_jpeg_quality} if face_format == 'JPEG' else {}
+        Image.fromarray(face, 'RGB').save(buffer, format=face_format, **options)
+        return {'data': base64.b64encode(buffer.getvalue()).decode('ascii')}
+    # list of (r, g, b) pixels, row by row
+    return {'data': face.reshape([-1, 3]).tolist()}
+
+def detect_faces(imarray, max_size=None, upsample=None, min_face_size=None, detection_array=None):
+    '''
+    The detection runs on the image downscaled to max_size, the faces are aligned from the original image.
+    :param imarray: the RGB image array
+    :param max_size: the longest side of the image to detect on, settings.detection_max_size by default
+    :param upsample: the times dlib upsamples the image, settings.detection_upsample by default
+    :param min_face_size: the smaller faces (in the original image) are dropped, settings.detection_min_face_size by default
+    :param detection_array: the image already downscaled, e.g. decoded in JPEG draft mode, imarray by default
+    :return: list of (coordinates [left, top, right, bottom], aligned face array)
+    '''
+    max_size = settings.detection_max_size if max_size is None else max_size
+    upsample = settings.detection_upsample if upsample is None else upsample
+    min_face_size = settings.detection_min_face_size if min_face_size is None else min_face_size
+
+    detector = model_registry.get_detector()
+    aligner = model_registry.get_aligner()
+
+    detection_array = imarray if detection_array is None else detection_array
+    if max_size is not None and max(detection_array.shape[:2]) > max_size:
+        ratio = max_size / max(detection_array.shape[:2])
+        detection_array = cv2.resize(detection_array, (int(round(detection_array.shape[1] * ratio)), int(round(detection_array.shape[0] * ratio))), interpolation=cv2.INTER_AREA)
+    scale = detection_array.shape[1] / imarray.shape[1]
+
+    bbs = []
+    for detection in detector(detection_array, upsample):
+        # back to the coordinates of the original image
+        bb = dlib.rectangle(int(round(detection.left() / scale)), int(round(detection.top() / scale)),
+                            int(round(detection.right() / scale)), int(round(detection.bottom() / scale)))
+        if min(bb.width(), bb.height()) >= min_face_size:
+            bbs.append(bb)
+
+    if hasattr(aligner, 'align_all'):
+        aligned_faces = aligner.align_all(settings.openface_imgDim, imarray, bbs)
+    else:
+        aligned_faces = [aligner.align(settings.openface_imgDim, imarray, bb=bb) for bb in bbs]
+    return [([bb.left(), bb.top(), bb.right(), bb.bottom()], face) for bb, face in zip(bbs, aligned_faces)]
+
+def decode_photo(upload):
+    '''
+    Decode the uploaded photo for the detection, a JPEG directly at about the detection size.
+    '''
+    draft_size = None if settings.detection_max_size is None else (settings.detection_max_size, settings.detection_max_size)
+    return decode_image(upload, draft_size=draft_size)
+
+def detect_uploaded_faces(upload):
+    '''
+    Detect on the draft decoded photo, align from the photo decoded at its original size.
+    :return: list of (coordinates in the original photo, aligned face array)
+    '''
+    detection_array = decode_photo(upload)
+    if tuple(original_size(upload)) == (detection_array.shape[1], detection_array.shape[0]):
+        # not downscaled while decoding
+        imarray = detection_array
+    else:
+        imarray = decode_image(upload)
+
+    return detect_faces(imarray, detection_array=detection_array)
 
 class FaceDetectionService(BaseService):
+    extractor = model_registry.get_extractor()
 
     def is_valid_input_data(self, data=None, app=None):
         # check required user input
         if 'image' not in data:
             return False, 'Field <image> is required.'
+        try:
+            decode_photo(data['image'])
+        except ImageError as e:
+            return False, str(e)
+        if 'feature' in data and (data['feature'].upper() not in settings.all_feature_names):
+            return False, 'Feature name is invalid. Valid options: ' + ', '.join(settings.all_feature_names) + '.'
+        if 'format' in data and (data['format'].upper() not in settings.face_formats):
+            return False, 'Format is invalid. Valid options: ' + ', '.join(settings.face_formats) + '.'
         return True, ''
 
     def execute(self, *args, **kwargs):
         """
         :param data: 
             image: the original image
+            feature: (optional) also extract this feature of every detected face in one batch
+            format: (optional) the face payload, LIST (default), PNG, JPEG or RAW
         :return: 
             {
-                'faces': image matrix as list
+                'faces': image matrix as list (and the feature vector if asked)
             }
             *** Decode ***
             import numpy as np
             from PIL import Image
             
-            face_array = np.asarray(face)
+            face_array = np.asarray(face)  # LIST
+            face_array = np.array(Image.open(io.BytesIO(base64.b64decode(data))))  # PNG, JPEG
+            face_array = np.frombuffer(base64.b64decode(data), dtype=np.uint8).reshape(shape)  # RAW
             face_image = Image.fromarray(face_array, 'RGB')
         """
 
         # receive the input data
         assert('data' in kwargs)
         image_data = kwargs['data']['image']
-
-        detector = dlib.get_frontal_face_detector()
-        predictor = dlib.shape_predictor(settings.landmark_model_path)
-        aligner = openface.AlignDlib(settings.openface_align_path)
-        #aligner = FaceAligner(dest_sz=settings.face_size, offset_pct=settings.eye_offset_percentage)
-
-        image = Image.open(image_data).convert('RGB')
-        imarray = np.array(image)
-
-        detections  = detector(imarray)
+        face_format = kwargs['data'].get('format', 'LIST').upper()
 
         faces = []
-        for detection in detections:
-            origin_size = (detection.right() - detection.left(), detection.bottom() - detection.top())
+        aligned_faces = []
+        for coordinates, face in detect_uploaded_faces(image_data):
+            aligned_faces.append(face)
 
-            coordinates = [detection.left(), detection.top(), detection.right(), detection.bottom()]
-            
-            face = aligner.align(settings.openface_imgDim, imarray, bb=detection)
+            faces.append(dict(encode_face(face, face_format), format=face_format, size=settings.face_size, coordinates=coordinates))
 
-            data = [(pixel[0], pixel[1], pixel[2]) for row in np.asarray(face) for pixel in row]
-            faces.append({'data': data, 'size': settings.face_size, 'coordinates': coordinates})
+        # extract the features of all detected faces at once
+        if 'feature' in kwargs['data'] and len(aligned_faces) != 0:
+            features = self.extractor.extract_batch(aligned_faces, kwargs['data']['feature'].upper()).real
+            for face, feature in zip(faces, features):
+                face['feature'] = feature.tolist()
 
         return {'faces': faces}
@@ -0,0 +1,89 @@
+from .base_service import BaseService
+from company.models import Face, Feature, insert_features
+# image, decoded as at the upload (EXIF orientation)
+from .image_ingest import decode_image
+# service settings
+from . import settings
+# feature
+from . import model_registry
+# feature backfill
+from .enrollment_pool import FeatureBackfill, pool_available
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+
+def get_face_features(appID, faces, feature_name):
+    '''
+    Read the saved features of the faces. Features not found are calculated in one batch and saved.
+    :return: list of numpy ndarray, in the same order as faces
+    '''
+    saved = dict(Feature.objects.for_app(appID).filter(face__in=[face.id for face in faces], feature_name=feature_name).values_list('face_id', 'data'))
+
+    results = [saved.get(face.id) for face in faces]
+    missing = [i for i, result in enumerate(results) if result is None]
+    if len(missing) == 0:
+        return results
+
+    # many faces, calculate and save in the process pool (not from a request, see pool_available())
+    if len(missing) >= settings.enrollment_pool_min_faces and pool_available():
+        extracted = FeatureBackfill().run(appID, [faces[i] for i in missing], feature_name)
+        for i in missing:
+            results[i] = extracted[faces[i].id]
+        return results
+
+    # if not found, calculate and save
+    face_arrays = []
+    for i in missing:
+        # from the path, the decoded array is not kept on the face
+        face_arrays.append(decode_image(faces[i].image.path))
+    features = model_registry.get_extractor().extract_batch(face_arrays, feature_name).real
+
+    new_features = []
+    for i, feature_data in zip(missing, features):
+        results[i] = feature_data.reshape([-1, 1])
+        new_features.append(Feature(face=faces[i], feature_name=feature_name, data=results[i]))
+    # the ones saved meanwhile by another command are read again
+    saved = insert_features(appID, new_features)
+    for i in missing:
+        results[i] = saved.get((faces[i].id, feature_name), results[i])
+    return results
+
+
+def enabled_features(app):
+    '''
+    :return: the features extracted when a face is uploaded to the app, all of them if the app does not choose
+    '''
+    return app.get_enabled_features() or list(model_registry.get_extractor().extractors.keys())
+
+
+class FeatureExtractionService(BaseService):
+    '''
+    Extract the enabled features of the app's faces which miss them. Queued by the face upload and run by the
+    command worker, the enrollment extracts whatever is still missing on demand.
+    '''
+    def is_valid_input_data(self, data=None, app=None):
+        assert(data is not None)
+        assert(app is not None)
+
+        if 'feature' in data and (data['feature'].upper() not in settings.all_feature_names):
+            return False, 'Feature not found.'
+        return True, ''
+
+    def execute(self, *args, **kwargs):
+        app = kwargs['app']
+        data = kwargs['data']
+        progress = kwargs.get('progress')
+
+        feature_names = [data['feature'].upper()] if 'feature' in data else enabled_features(app)
+
+        extracted = {}
+        for index, feature_name in enumerate(feature_names):
+            faces = list(Face.objects.for_app(app.appID).exclude(features__feature_name=feature_name))
+            if len(faces) != 0:
+                get_face_features(app.appID, faces, feature_name)
+            extracted[feature_name] = len(faces)
+            log.info('App %s: %d features %s extracted.' % (app.appID, len(faces), feature_name))
+            if progress is not None:
+                progress((index + 1) / len(feature_names))
+        return {'extracted': extracted}
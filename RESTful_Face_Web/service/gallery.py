@@ -0,0 +1,151 @@
+'''
+This file holds the gallery of an app's templates as one contiguous matrix for nearest neighbor search.
+The squared distance to every template is |t|^2 - 2 t.p + |p|^2, so one matrix-vector product scores the probe
+against the whole gallery and argpartition picks the top k without sorting all of it.
+
+The decoded galleries are cached per worker in gallery_cache, keyed by (appID, feature name). App.update_time is
+the version stamp of an entry: uploading a face, deleting a subject and enrolling all save the app. The least
+recently used entries are evicted when the size of the cached galleries exceeds settings.gallery_cache_max_bytes.
+'''
+
+# service settings
+from . import settings
+# data structure
+import numpy as np
+# cache
+from collections import OrderedDict
+import threading
+
+
+class GalleryIndex:
+    def __init__(self, templates, subjects):
+        '''
+        :param templates:
+            list of template vectors, one per subject
+        :param subjects:
+            list of subject IDs in the same order
+        '''
+        assert(len(templates) == len(subjects))
+        self.subjects = np.array(subjects)
+        self.templates = np.ascontiguousarray(np.vstack([np.reshape(template, [1, -1]) for template in templates]), dtype=np.float32)  # N x d
+        self.squared_norms = np.einsum('ij,ij->i', self.templates, self.templates)  # N
+
+    def __len__(self):
+        return len(self.subjects)
+
+    @property
+    def nbytes(self):
+        return self.templates.nbytes + self.squared_norms.nbytes + self.subjects.nbytes
+
+    def search(self, probe_feature, k):
+        '''
+        :param probe_feature:
+            the probe vector
+        :param k:
+            the number of nearest templates
+        :return:
+            (indices, distances) of the k nearest templates, the nearest first
+        '''
+        probe = np.asarray(probe_feature, dtype=np.float32).reshape([-1])
+        squared_distance = self.squared_norms - 2 * np.dot(self.templates, probe) + np.dot(probe, probe)
+        return self._top_k(squared_distance, k)
+
+    def search_batch(self, probe_features, k, max_elements=1 << 24):
+        '''
+        :param probe_features:
+            the probe vectors. (M x d)
+        :param k:
+            the number of nearest templates
+        :param max_elements:
+            the size of the distance matrix of a chunk of probes
+        :return:
+            (indices, distances) of the k nearest templates of each probe, the nearest first. (M x k)
+        '''
+        probes = np.ascontiguousarray(np.reshape(probe_features, [len(probe_features), -1]), dtype=np.float32)
+        k = min(k, len(self))
+        chunk_size = max(1, max_elements // len(self))
+
+        indices = np.empty([len(probes), k], dtype=np.int64)
+        distances = np.empty([len(probes), k], dtype=np.float32)
+        for start in range(0, len(probes), chunk_size):
+            chunk = probes[start:start + chunk_size]
+            squared_distance = self.squared_norms - 2 * np.dot(chunk, self.templates.T) + np.einsum('ij,ij->i', chunk, chunk)[:, None]
+
+            rows = np.arange(len(chunk))[:, None]
+            if k < len(self):
+                topk = np.argpartition(squared_distance, k - 1, axis=1)[:, :k]
+            else:
+                topk = np.tile(np.arange(len(self)), [len(chunk), 1])
+            topk = topk[rows, np.argsort(squared_distance[rows, topk], axis=1)]
+            indices[start:start + chunk_size] = topk
+            distances[start:start + chunk_size] = np.sqrt(np.maximum(squared_distance[rows, topk], 0))
+        return indices, distances
+
+    def _top_k(self, squared_distance, k):
+        k = min(k, len(self))
+        if k < len(self):
+            indices = np.argpartition(squared_distance, k - 1)[:k]
+        else:
+            indices = np.arange(len(self))
+        indices = indices[np.argsort(squared_distance[indices])]
+        # rounding can make the squared distance of a near duplicate slightly negative
+        return indices, np.sqrt(np.maximum(squared_distance[indices], 0))
+
+
+class GalleryCache:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = settings.gallery_cache_max_bytes if max_bytes is None else max_bytes
+        self._entries = OrderedDict()  # (appID, feature name) -> (version stamp, gallery, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, app, feature_name, loader):
+        '''
+        :param app:
+            the App, its update_time is the version stamp
+        :param feature_name:
+            the feature of the templates
+        :param loader:
+            function returning the gallery, called when there is no valid entry
+        :return:
+            the cached gallery
+        '''
+        key = (app.appID, feature_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == app.update_time:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        gallery = loader()
+        size = _nbytes(gallery)
+        with self._lock:
+            self._pop(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (app.update_time, gallery, size)
+                self._size += size
+                while self._size > self.max_bytes:
+                    self._pop(next(iter(self._entries)))
+        return gallery
+
+    def invalidate(self, appID):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == appID]:
+                self._pop(key)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+def _nbytes(value):
+    '''
+    :return: the size of the arrays of a cached value, e.g. (GalleryIndex, outdated flag)
+    '''
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(item) for item in value)
+    return getattr(value, 'nbytes', 0)
+
+
+gallery_cache = GalleryCache()
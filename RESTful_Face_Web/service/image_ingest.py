@@ -0,0 +1,106 @@
+'''
+Decode the uploaded images once for both the validation and the execution of a service.
+The size of an image is checked from its header before any pixel is decoded, JPEG photos are downscaled while
+decoding (PIL draft mode) and the EXIF orientation is applied. The decoded RGB array is kept on the upload object,
+so the later calls with the same upload return it without decoding again.
+'''
+
+# service settings
+from . import settings
+# image
+from PIL import Image
+import numpy as np
+
+# EXIF orientation tag -> the transposes that bring the image upright
+EXIF_ORIENTATION = 0x0112
+ORIENTATION_TRANSPOSES = {
+    2: [Image.FLIP_LEFT_RIGHT],
+    3: [Image.ROTATE_180],
+    4: [Image.FLIP_TOP_BOTTOM],
+    5: [Image.ROTATE_90, Image.FLIP_TOP_BOTTOM],
+    6: [Image.ROTATE_270],
+    7: [Image.ROTATE_270, Image.FLIP_TOP_BOTTOM],
+    8: [Image.ROTATE_90],
+}
+
+
+class ImageError(ValueError):
+    pass
+
+
+def decode_image(upload, draft_size=None):
+    '''
+    :param upload:
+        the uploaded file (or any file object) of the image
+    :param draft_size:
+        (width, height), a JPEG is decoded at the smallest scale (1/2, 1/4 or 1/8) not smaller than this
+    :return:
+        the RGB array of the image
+    :raise ImageError:
+        the image is corrupted or too large
+    '''
+    cached = getattr(upload, '_decoded_image', None)
+    if cached is not None and cached[0] == draft_size:
+        return cached[2]
+
+    original_size, array = _decode(upload, draft_size)
+    try:
+        upload._decoded_image = (draft_size, original_size, array)
+    except AttributeError:
+        pass
+    return array
+
+
+def original_size(upload):
+    '''
+    :return: (width, height) of the image before the draft downscaling, the upload must be decoded
+    '''
+    return upload._decoded_image[1]
+
+
+def _decode(upload, draft_size):
+    if hasattr(upload, 'seek'):
+        upload.seek(0)
+    try:
+        # only the header is read here
+        image = Image.open(upload)
+    except Exception:
+        raise ImageError('Image wrong format or image data corrupted!')
+
+    width, height = image.size
+    if width * height > settings.max_image_pixels:
+        raise ImageError('Image is too large(%dx%d). At most %d pixels.' % (width, height, settings.max_image_pixels))
+
+    orientation = _exif_orientation(image)
+    try:
+        if draft_size is not None and image.format == 'JPEG':
+            image.draft('RGB', tuple(draft_size))
+        array = np.array(image.convert('RGB'))
+    except Exception:
+        raise ImageError('Image wrong format or image data corrupted!')
+    finally:
+        image.close()
+
+    # upright
+    for method in ORIENTATION_TRANSPOSES.get(orientation, []):
+        array = np.ascontiguousarray(_transpose(array, method))
+    if orientation in [5, 6, 7, 8]:
+        width, height = height, width
+    return (width, height), array
+
+
+def _exif_orientation(image):
+    try:
+        exif = image._getexif() if hasattr(image, '_getexif') else None
+    except Exception:
+        exif = None
+    return None if exif is None else exif.get(EXIF_ORIENTATION)
+
+
+def _transpose(array, method):
+    if method == Image.FLIP_LEFT_RIGHT:
+        return array[:, ::-1]
+    if method == Image.FLIP_TOP_BOTTOM:
+        return array[::-1]
+    # counter-clockwise rotations
+    return np.rot90(array, {Image.ROTATE_90: 1, Image.ROTATE_180: 2, Image.ROTATE_270: 3}[method])
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand, CommandError
+# models
+from company.models import FeatureTemplate
+# search
+from service import settings
+from service.ann import IVFIndex
+from service.gallery import GalleryIndex
+# data
+import numpy as np
+import time
+
+
+class Command(BaseCommand):
+    help = 'Report recall@k and latency of the ANN index against the exact nearest neighbor search.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--app', help='Use the templates of this app. Random clustered templates if not given.')
+        parser.add_argument('--feature', default=settings.default_name, help='Feature of the templates.')
+        parser.add_argument('--synthetic', type=int, default=10000, help='Number of random templates (without --app).')
+        parser.add_argument('--dimension', type=int, default=128, help='Dimension of random templates (without --app).')
+        parser.add_argument('--queries', type=int, default=200, help='Number of probes.')
+        parser.add_argument('--noise', type=float, default=0.05, help='Std of the noise added to a template to make a probe.')
+        parser.add_argument('--k', type=int, nargs='+', default=[1, 5, 10])
+        parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 8, 16, 32])
+
+    def handle(self, *args, **options):
+        random = np.random.RandomState(0)
+
+        if options['app'] is not None:
+            templates = FeatureTemplate.objects.for_app(options['app']).filter(feature_name=options['feature'].upper()).select_related('subject')
+            data = [template.data.reshape([-1]) for template in templates]
+            subjects = [template.subject.subjectID for template in templates]
+            if len(data) == 0:
+                raise CommandError('No template of feature %s in app %s.' % (options['feature'], options['app']))
+        else:
+            centers = random.randn(max(1, options['synthetic'] // 100), options['dimension'])
+            data = [centers[i % len(centers)] + 0.3 * random.randn(options['dimension']) for i in range(options['synthetic'])]
+            subjects = [str(i) for i in range(options['synthetic'])]
+        data = np.vstack(data)
+        scale = np.mean(np.linalg.norm(data, axis=1))
+
+        start = time.time()
+        exact = GalleryIndex(data, subjects)
+        index = IVFIndex.build(data, subjects)
+        self.stdout.write('%d templates, %d lists, built in %.2f s' % (len(index), index.n_lists, time.time() - start))
+
+        probes = data[random.choice(len(data), options['queries'])] + options['noise'] * scale * random.randn(options['queries'], data.shape[1])
+        max_k = max(options['k'])
+
+        start = time.time()
+        truth = [exact.subjects[exact.search(probe, max_k)[0]] for probe in probes]
+        self.stdout.write('exact: %.3f ms/query' % ((time.time() - start) * 1000 / len(probes)))
+
+        for nprobe in options['nprobe']:
+            start = time.time()
+            found = [index.search(probe, max_k, nprobe=nprobe)[0] for probe in probes]
+            latency = (time.time() - start) * 1000 / len(probes)
+
+            recalls = ['recall@%d %.3f' % (k, np.mean([len(set(f[:k]) & set(t[:k])) / float(min(k, len(t))) for f, t in zip(found, truth)]))
+                       for k in options['k']]
+            self.stdout.write('nprobe %d: %.3f ms/query, %s' % (nprobe, latency, ', '.join(recalls)))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+# service
+from service import settings
+from service.projection import build_cache
+
+
+class Command(BaseCommand):
+    help = 'Convert the PCA/LDA/LBP projection matrices into pre-sliced float32 .npy files that every worker maps read-only.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('features', nargs='*', help='Features to build (PCA, LDA, LBP). All of them by default.')
+
+    def handle(self, *args, **options):
+        names = [name.upper() for name in options['features']] or None
+        if names is not None:
+            for name in names:
+                if name not in [settings.pca_name, settings.lda_name, settings.lbp_name]:
+                    raise CommandError('Feature %s has no projection matrix.' % (name))
+
+        for path in build_cache(names):
+            self.stdout.write('Written %s' % (path))
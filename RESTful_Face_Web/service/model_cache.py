@@ -0,0 +1,65 @@
+'''
+This file holds the loaded classifier models (unpickled SVMs, ANN indexes) per worker, so repeat recognitions skip
+the disk and the deserialization.
+An entry is keyed by (appID, classifier name, feature name) and versioned by ClassifierModel.modified_time, so a
+retrained model replaces its stale entry. The least recently used entries are evicted when the size of the cached
+models, estimated by their parameter file size, exceeds settings.classifier_cache_max_bytes.
+'''
+
+# service settings
+from . import settings
+# cache
+from collections import OrderedDict
+import threading
+
+
+class ClassifierModelCache:
+    def __init__(self, max_bytes=None):
+        self.max_bytes = settings.classifier_cache_max_bytes if max_bytes is None else max_bytes
+        self._entries = OrderedDict()  # (appID, classifier name, feature name) -> (modified time, loaded model, size)
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, model, loader):
+        '''
+        :param model:
+            the ClassifierModel
+        :param loader:
+            function returning the loaded model from the opened parameter file, called when there is no valid entry
+        :return:
+            the loaded model
+        '''
+        key = (model.appID, model.classifier_name, model.feature_name)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == model.modified_time:
+                self._entries.move_to_end(key)
+                return entry[1]
+
+        try:
+            size = model.parameter_file.size
+            loaded = loader(model.parameter_file)
+        finally:
+            model.parameter_file.close()
+
+        with self._lock:
+            self._pop(key)
+            if size <= self.max_bytes:
+                self._entries[key] = (model.modified_time, loaded, size)
+                self._size += size
+                while self._size > self.max_bytes:
+                    self._pop(next(iter(self._entries)))
+        return loaded
+
+    def invalidate(self, appID):
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == appID]:
+                self._pop(key)
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[2]
+
+
+classifier_model_cache = ClassifierModelCache()
@@ -0,0 +1,102 @@
+'''
+Process-wide registry of the loaded models.
+Every model (dlib detector, landmark predictor, openface aligner and torch net, feature extractor) is loaded
+once per worker on first use and shared by all services afterwards.
+Call warm_up() after the worker is forked (see wsgi.py) so that the first request does not pay the loading time.
+'''
+
+# service settings
+from . import settings
+# face detection
+import dlib
+import openface
+# thread safe lazy loading
+import threading
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+
+def _load_extractor():
+    from .extraction import FeatureExtractor
+    return FeatureExtractor()
+
+
+def _load_aligner():
+    if settings.face_aligner == 'eyes':
+        from .face_detection import FaceAligner
+        return FaceAligner(dest_sz=settings.face_size, offset_pct=settings.eye_offset_percentage, predictor=get_predictor())
+    return openface.AlignDlib(settings.openface_align_path)
+
+
+def _load_projections():
+    from .projection import load_projection
+    return [load_projection(name) for name in (settings.pca_name, settings.lda_name, settings.lbp_name)]
+
+
+_loaders = {
+    'detector': lambda: dlib.get_frontal_face_detector(),
+    'predictor': lambda: dlib.shape_predictor(settings.landmark_model_path),
+    'aligner': _load_aligner,
+    'openface_nn': lambda: openface.TorchNeuralNet(settings.openface_model_path, imgDim=settings.openface_imgDim),
+    'extractor': _load_extractor,
+    'projections': _load_projections,
+}
+
+_models = {}
+_lock = threading.RLock()
+
+
+def get(name):
+    '''
+    :param name: one of the registered model names
+    :return: the model, loaded on first use
+    '''
+    if name in _models:
+        return _models[name]
+
+    with _lock:
+        if name not in _models:
+            log.info('Loading model "%s".' % (name))
+            _models[name] = _loaders[name]()
+    return _models[name]
+
+
+def get_detector():
+    return get('detector')
+
+
+def get_predictor():
+    return get('predictor')
+
+
+def get_aligner():
+    return get('aligner')
+
+
+def get_openface_net():
+    return get('openface_nn')
+
+
+def get_extractor():
+    return get('extractor')
+
+
+def warm_up(names=None):
+    '''
+    Load the models before the first request.
+    :param names: the models to load, settings.warm_up_models by default
+    '''
+    names = settings.warm_up_models if names is None else names
+    for name in names:
+        get(name)
+    log.info('Models warmed up: %s' % (', '.join(names)))
+
+
+def reset():
+    '''
+    Forget every loaded model, so the current process loads its own. Used in forked child processes,
+    which must not share the pipes of the parent's torch net.
+    '''
+    with _lock:
+        _models.clear()
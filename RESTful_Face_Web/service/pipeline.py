@@ -0,0 +1,59 @@
+from .recognition import RecognitionService
+from .face_detection import detect_uploaded_faces, decode_photo
+from .image_ingest import ImageError
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+
+class PipelineService(RecognitionService):
+    '''
+    Detect, align and recognize all the faces of a photo on the server, the faces never leave memory.
+    '''
+    def is_valid_input_data(self, data=None, app=None):
+        '''
+        :param data:
+            'image' The photo. The other options are the ones of /commands/recognize/
+        '''
+        assert(data is not None)
+        assert(app is not None)
+
+        if 'image' not in data:
+            return False, 'Field <image> is required.'
+
+        try:
+            decode_photo(data['image'])
+        except ImageError as e:
+            return False, str(e)
+
+        return self._is_valid_options(data, app)
+
+    def execute(self, *args, **kwargs):
+        """
+        :return:
+            {
+                'faces': [{'coordinates': [left, top, right, bottom], 'subjectID': [...], 'distance': [...]}, ...]
+            }
+        """
+        assert('data' in kwargs)
+        assert('app' in kwargs)
+
+        app = kwargs['app']
+        options = self._parse_options(kwargs['data'])
+
+        detections = detect_uploaded_faces(kwargs['data']['image'])
+        log.info('%d faces detected.' % (len(detections)))
+        if len(detections) == 0:
+            return {'faces': []}
+
+        coordinates, faces = zip(*detections)
+        probe_features = self.extractor.extract_batch(list(faces), options['feature_name']).real
+
+        results, warning = self._classify(app, probe_features, options)
+        if isinstance(results, dict):
+            return results
+
+        results = {'faces': [dict(result, coordinates=face_coordinates) for face_coordinates, result in zip(coordinates, results)]}
+        if warning is not None:
+            results['warning'] = warning
+        return results
@@ -0,0 +1,140 @@
+'''
+This file is the linear projection engine used by the PCA, LDA and LBP features.
+The projection matrix is kept pre-sliced, contiguous and float32, so that a whole batch of faces
+(one face per row) is projected with a single matrix multiplication.
+
+The matrices are big (PCA W is 25500 x 13145). build_cache() writes them once, already sliced and
+converted, into settings.projection_cache_dir. load_projection() maps the cached files read-only, so
+every uwsgi worker shares the same pages of the page cache instead of holding a private copy.
+'''
+
+# service settings
+from . import settings
+# data structure
+import numpy as np
+# file system
+import os
+import threading
+# logging
+import logging
+log = logging.getLogger(__name__)
+
+
+class Projection:
+    def __init__(self, w, mean=None, k=None):
+        '''
+        :param w:
+            the projection matrix. (D x K), one component per column
+        :param mean:
+            the mean vector subtracted before projection. (D x 1) or None
+        :param k:
+            only keep the first k components
+        '''
+        if k is not None:
+            w = w[:, :k]
+        self.w = np.ascontiguousarray(w, dtype=np.float32)  # D x k
+        self.mean = None if mean is None else np.ascontiguousarray(np.reshape(mean, [1, -1]), dtype=np.float32)  # 1 x D
+
+    @property
+    def input_dimension(self):
+        return self.w.shape[0]
+
+    @property
+    def output_dimension(self):
+        return self.w.shape[1]
+
+    def project(self, X):
+        '''
+        :param X:
+            the data matrix. (N x D), one face per row
+        :return:
+            the feature matrix. (N x k)
+        '''
+        X = np.asarray(X, dtype=np.float32).reshape([len(X), -1])
+        assert(X.shape[1] == self.input_dimension)
+        if self.mean is not None:
+            X = X - self.mean
+        return np.dot(X, self.w)
+
+
+def _sources():
+    '''
+    :return: {name: (w path, mean path, k)} of every projection
+    '''
+    return {
+        settings.pca_name: (settings.pca_w_path, settings.pca_mean_path, settings.pca_k),
+        settings.lda_name: (settings.lda_w_path, settings.lda_mean_path, None),
+        settings.lbp_name: (settings.lbp_lda_w_path, None, None),
+    }
+
+
+def _cache_paths(name):
+    return (os.path.join(settings.projection_cache_dir, name.lower() + '_w.npy'),
+            os.path.join(settings.projection_cache_dir, name.lower() + '_mean.npy'))
+
+
+# one projection per process, shared by every FeatureExtractor
+_projections = {}
+_lock = threading.Lock()
+
+
+def load_projection(name):
+    '''
+    :param name: feature name, one of PCA, LDA, LBP
+    :return: the Projection of the feature. Memory mapped from the cache if it has been built.
+    '''
+    if name in _projections:
+        return _projections[name]
+
+    with _lock:
+        if name not in _projections:
+            w_path, mean_path, k = _sources()[name]
+            cache_w_path, cache_mean_path = _cache_paths(name)
+
+            if os.path.exists(cache_w_path):
+                # already sliced, contiguous and float32, so Projection keeps the mapped arrays as they are
+                w = np.load(cache_w_path, mmap_mode='r')
+                mean = np.load(cache_mean_path, mmap_mode='r') if mean_path is not None else None
+                _projections[name] = Projection(w, mean=mean)
+            else:
+                log.warning('No projection cache for %s, loading a private copy. Run "manage.py build_projection_cache".' % (name))
+                w = np.load(w_path, mmap_mode='r')
+                mean = np.load(mean_path, mmap_mode='r') if mean_path is not None else None
+                _projections[name] = Projection(w, mean=mean, k=k)
+    return _projections[name]
+
+
+def build_cache(names=None):
+    '''
+    Write the pre-sliced, contiguous, float32 projection matrices into settings.projection_cache_dir.
+    :param names: the features to build, all of them by default
+    :return: list of the written file paths
+    '''
+    sources = _sources()
+    if names is None:
+        names = list(sources.keys())
+
+    if not os.path.exists(settings.projection_cache_dir):
+        os.makedirs(settings.projection_cache_dir)
+
+    written = []
+    for name in names:
+        w_path, mean_path, k = sources[name]
+        cache_w_path, cache_mean_path = _cache_paths(name)
+
+        projection = Projection(np.load(w_path, mmap_mode='r'), mean=np.load(mean_path) if mean_path is not None else None, k=k)
+        _save(cache_w_path, projection.w)
+        written.append(cache_w_path)
+        if projection.mean is not None:
+            _save(cache_mean_path, projection.mean)
+            written.append(cache_mean_path)
+        log.info('Projection cache of %s built: %s' % (name, str(projection.w.shape)))
+    return written
+
+
+def _save(path, array):
+    # write then rename, a worker mapping the old file keeps a valid mapping
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    os.rename(tmp_path, path)
@@ -8,13 +8,12 @@ from company.models import Subject, Face, Feature, ClassifierModel, FeatureTempl
 from company.serializers import SubjectSerializer
 from django.core.exceptions import ObjectDoesNotExist, MultipleObjectsReturned
 # image
-from PIL import Image
-# string-list convertor
-import json
+from .image_ingest import decode_image, ImageError
 # feature
-from .extraction import FeatureExtractor
+from . import model_registry
 # classifier
 from .classification import Classifier
+from .gallery import GalleryIndex, gallery_cache
 # save file
 import tempfile
 # logging
@@ -22,13 +21,12 @@ import logging
 log = logging.getLogger(__name__)
 # openface
 import openface
-import cv2
 import dlib
 # time
 from datetime import datetime
 
 class RecognitionService(BaseService):
-    extractor = FeatureExtractor()
+    extractor = model_registry.get_extractor()
     classifiers = Classifier()
 
     def is_valid_input_data(self, data=None, app=None):
@@ -45,15 +43,16 @@ class RecognitionService(BaseService):
             return False, '<face> is required.'
 
         try:
-            face = Image.open(data['face'])
-            face_array = np.array(face)
-            cv2.cvtColor(face_array, cv2.COLOR_RGB2BGR)
-        except:
-            return False, 'Face image wrong format or image data corrupted!'
+            face_array = decode_image(data['face'])
+        except ImageError as e:
+            return False, str(e)
 
-        if not (tuple(face.size) == tuple(settings.face_size)):
-            return False, 'Face image has a wrong size' + str(face.size) + '. It should be '+ str(settings.face_size) + '.'
+        if not (tuple(face_array.shape[1::-1]) == tuple(settings.face_size)):
+            return False, 'Face image has a wrong size' + str(face_array.shape[1::-1]) + '. It should be '+ str(settings.face_size) + '.'
 
+        return self._is_valid_options(data, app)
+
+    def _is_valid_options(self, data, app):
         if 'feature' in data and (data['feature'].upper() not in settings.all_feature_names):
             return False, 'Feature name is invalid. Valid options: ' + ', '.join(settings.all_feature_names) + '.'
         
@@ -63,13 +62,20 @@ class RecognitionService(BaseService):
         if 'k' in data:
             try:
                k = int(data['k'])
-               if len(Subject.objects.using(app.appID).all()) < k and k <= 0:
+               if len(Subject.objects.for_app(app.appID).all()) < k and k <= 0:
                    return False, 'k is invalid. Must within [1, len(subjects)]'
             except ValueError:
                 return False, 'k should be a integer.'
 
         if 'threshold' in data and data['threshold'].lower() not in ['l', 'm', 'h']:
             return False, 'Threshold(%s) not understand.'%(data['threshold'])
+
+        if 'nprobe' in data:
+            try:
+                if int(data['nprobe']) <= 0:
+                    return False, 'nprobe should be positive.'
+            except ValueError:
+                return False, 'nprobe should be a integer.'
         return True, ''
 
 
@@ -77,54 +83,69 @@ class RecognitionService(BaseService):
         assert('data' in kwargs)
         assert('app' in kwargs)
 
-        face_image = Image.open(kwargs['data']['face'])
+        face_image = decode_image(kwargs['data']['face'])
         app = kwargs['app']
-        request = kwargs['request']
+        options = self._parse_options(kwargs['data'])
+
+        # get input data
+        probe_feature = self.extractor.extract(face_image, name=options['feature_name']).real
+        log.info('probe_feature shape: %s'%(str(np.shape(probe_feature))))
 
+        results, warning = self._classify(app, np.reshape(probe_feature, [1, -1]), options)
+        if isinstance(results, dict):
+            return results
+        results = results[0]
+        if warning is not None:
+            results['warning'] = warning
+        return results
+
+    def _parse_options(self, data):
         # top k 
-        k = 1 if 'k' not in kwargs['data'] else int(kwargs['data']['k'])
+        k = 1 if 'k' not in data else int(data['k'])
 
         # feature
         feature_name = 'DEFAULT'
-        if 'feature' in kwargs['data']:
-            feature_name = kwargs['data']['feature'].upper() # must valid feature name
+        if 'feature' in data:
+            feature_name = data['feature'].upper() # must valid feature name
 
         log.info('Use feature "%s".'%(feature_name))
 
         # classifier
         classifier_name = 'DEFAULT'
-        if 'classifier' in kwargs['data']:
-            classifier_name = kwargs['data']['classifier'].upper() # must valid classifier name
+        if 'classifier' in data:
+            classifier_name = data['classifier'].upper() # must valid classifier name
 
         log.info('Use classifier "%s".'%(classifier_name))
 
         # threshold
         threshold = None
-        if 'threshold' in kwargs['data']:
-            threshold = settings.openface_NN_Threshold[kwargs['data']['threshold'].upper()]
+        if 'threshold' in data:
+            threshold = settings.openface_NN_Threshold[data['threshold'].upper()]
 
-        # get input data
-        probe_feature = self.extractor.extract(face_image, name=feature_name).real
-        log.info('probe_feature shape: %s'%(str(np.shape(probe_feature))))
+        # the number of lists scanned by the ANN classifier
+        nprobe = None if 'nprobe' not in data else int(data['nprobe'])
+
+        return {'k': k, 'feature_name': feature_name, 'classifier_name': classifier_name, 'threshold': threshold, 'nprobe': nprobe}
+
+    def _classify(self, app, probe_features, options):
+        '''
+        :param probe_features: (N x d)
+        :return: (list of results, one per probe, or the error dict, the outdated warning or None)
+        '''
+        feature_name = options['feature_name']
+        classifier_name = options['classifier_name']
 
         # retrieve model and classify
         gallery = None
         template_outdate = False
         classifier_outdate = False
         if classifier_name in settings.need_template_classifiers:
-            templates = FeatureTemplate.objects.using(app.appID).filter(feature_name=feature_name) # check if outdated
+            gallery, template_outdate = gallery_cache.get(app, feature_name, lambda: self._load_gallery(app, feature_name))
 
-            if len(templates) == 0:
-                return {'info': 'No template found. Please upload face images and enroll them.', 'error_code': settings.NO_TEMPLATE_ERROR}
+            if gallery is None:
+                return {'info': 'No template found. Please upload face images and enroll them.', 'error_code': settings.NO_TEMPLATE_ERROR}, None
 
-            gallery = {'templates': [], 'subjects': []}
-            for template in templates:
-                if template.modified_time < template.subject.modified_time:
-                    template_outdate = True
-                gallery['templates'].append(np.array(json.loads(template.data)))
-                gallery['subjects'].append(template.subject.subjectID)
-
-        classifier_models = ClassifierModel.objects.using(app.appID).filter(feature_name=feature_name, classifier_name=classifier_name, appID=app.appID)
+        classifier_models = ClassifierModel.objects.for_app(app.appID).filter(feature_name=feature_name, classifier_name=classifier_name, appID=app.appID)
         assert(len(classifier_models)<2)
         if len(classifier_models) == 0:
             model = None
@@ -132,17 +153,37 @@ class RecognitionService(BaseService):
             model = classifier_models[0]
             if model.modified_time < app.update_time:
                 classifier_outdate = True
-        
-        results = self.classifiers.classify(probe_feature, classifier_name, k, model=model, gallery=gallery, threshold=threshold)
-        
+
+        results = self.classifiers.classify_batch(probe_features, classifier_name, options['k'], model=model, gallery=gallery,
+                                                  threshold=options['threshold'], nprobe=options['nprobe'])
+        # the classifier failed, e.g. not trained
+        if len(results) != 0 and isinstance(results[0], dict) and 'error_code' in results[0]:
+            return results[0], None
+
         tmp = []
         if template_outdate:
             tmp.append('template')
         if classifier_outdate:
             tmp.append('classifier ' + classifier_name)
+        warning = None
         if len(tmp) != 0:
             warning = ' and '.join(tmp) + ' outdated. Please use /command/enroll/ to update!'
-            results['warning'] = warning
-        return results
+        return results, warning
 
-        
+    def _load_gallery(self, app, feature_name):
+        '''
+        :return: (GalleryIndex of the app's templates or None if there is no template, whether any template is outdated)
+        '''
+        templates = FeatureTemplate.objects.for_app(app.appID).filter(feature_name=feature_name).select_related('subject')
+
+        template_data, subjects = [], []
+        template_outdate = False
+        for template in templates:
+            if template.modified_time < template.subject.modified_time: # check if outdated
+                template_outdate = True
+            template_data.append(template.data)
+            subjects.append(template.subject.subjectID)
+
+        if len(subjects) == 0:
+            return None, False
+        return GalleryIndex(template_data, subjects), template_outdate
@@ -8,6 +8,9 @@ from .recognition import RecognitionService
 from .compare import CompareService
 from .verification import VerificationService
 from .enrollment import EnrollmentService
+from .batch_recognition import BatchRecognitionService
+from .pipeline import PipelineService
+from .feature_extraction import FeatureExtractionService
 
 from company.models import SERVICES
 
@@ -23,7 +26,7 @@ SERVICES.append(ATTRIBUTE_PREDICATE)
 RECOGNITION = (3, 'Recognition', RecognitionService)
 SERVICES.append(RECOGNITION)
 
-FEATURE_EXTRACTION = (4, 'Feature Extraction', None)
+FEATURE_EXTRACTION = (4, 'Feature Extraction', FeatureExtractionService)
 SERVICES.append(FEATURE_EXTRACTION)
 
 ENHANCEMENT = (5, 'Enhancement', None)
@@ -40,3 +43,9 @@ SERVICES.append(VERIFICATION)
 
 ENROLLMENT = (9, 'Gallery Enrollment', EnrollmentService)
 SERVICES.append(ENROLLMENT)
+
+BATCH_RECOGNITION = (10, 'Batch Recognition', BatchRecognitionService)
+SERVICES.append(BATCH_RECOGNITION)
+
+PIPELINE = (11, 'Detection and Recognition', PipelineService)
+SERVICES.append(PIPELINE)
@@ -8,10 +8,15 @@ landmark_model_path = os.path.join(settings.BASE_DIR, 'service', 'shape_predicto
 openface_model_path = os.path.join(settings.BASE_DIR, 'service', 'openface', 'nn4.small2.v1.t7')
 openface_imgDim = 96
 openface_align_path = landmark_model_path
+# models loaded by service.model_registry.warm_up() right after a uwsgi worker is forked
+warm_up_models = ['detector', 'aligner', 'openface_nn', 'extractor']
+# faces sent to the torch net per pipe round trip (both pipe buffers have to hold a whole batch)
+openface_batch_size = 32
 
 # face alignment (keep same as experiment)
 face_size = (openface_imgDim, openface_imgDim) # have to be a tuple
 eye_offset_percentage = [0.25, 0.25]
+face_aligner = 'openface' # 'openface' (AlignDlib, eyes and nose) or 'eyes' (FaceAligner)
 
 # face feature dimension
 feature_dimension = [100, 1]
@@ -28,10 +33,11 @@ all_feature_names = [pca_name, lda_name, hog_name, lbp_name, default_name]
 nearest_neighbor_name = 'NEAREST_NEIGHBOR'
 naive_bayes_name = 'NAIVE_BAYES'
 svm_name = 'SVM'
+ann_name = 'ANN'
 default_name = 'DEFAULT'
-all_classifier_names = [nearest_neighbor_name, svm_name, default_name]
+all_classifier_names = [nearest_neighbor_name, svm_name, ann_name, default_name]
 need_template_classifiers = [nearest_neighbor_name, default_name]
-need_training_classifiers = [svm_name, ]
+need_training_classifiers = [svm_name, ann_name]
 
 # HOG settings
 hog_ori = 8
@@ -47,6 +53,9 @@ lda_mean_path = os.path.join(settings.BASE_DIR, 'service', 'lda', 'mean.npy') #
 # PCA principle component
 pca_k = 206 # cumulative 95%
 
+# pre-sliced float32 projection matrices, memory mapped by every worker (manage.py build_projection_cache)
+projection_cache_dir = os.path.join(settings.BASE_DIR, 'service', 'cache')
+
 # LBP settings
 lbp_regions_num = [6, 6]
 lbp_neighbors = 8
@@ -58,6 +67,49 @@ lbp_lda_w_path = os.path.join(settings.BASE_DIR, 'service', 'lbp', 'W.npy') # 34
 svm_c = 1
 svm_kernel = 'linear'
 
+# ANN settings (inverted file index over the templates)
+ann_max_lists = 1024 # the number of lists is sqrt(number of subjects), at most this
+ann_kmeans_iterations = 10
+ann_nprobe = 8 # lists scanned per probe by default, more lists for better recall but slower
+
+# loaded classifier models cached per worker, evicted least recently used beyond this size (of their parameter files)
+classifier_cache_max_bytes = 512 * 1024 * 1024
+# decoded template galleries cached per worker, evicted least recently used beyond this size
+gallery_cache_max_bytes = 512 * 1024 * 1024
+
+# uploaded images larger than this are rejected from their header
+max_image_pixels = 40 * 1000 * 1000
+
+# face detection, on the image downscaled to detection_max_size (longest side, None for the original size)
+detection_max_size = 1024
+detection_upsample = 0 # upsample to find faces smaller than 80x80 in the downscaled image, slower
+detection_min_face_size = 0 # pixels in the original image
+
+# face payload of /commands/detect/
+face_formats = ['LIST', 'PNG', 'JPEG', 'RAW']
+face_jpeg_quality = 90
+
+# /commands/recognize_batch/
+batch_recognition_max_faces = 256
+batch_recognition_max_bytes = 64 * 1024 * 1024 # uncompressed size of the members of an uploaded zip or npz
+
+# the face upload only queues the extraction of the app's enabled features, manage.py run_command_worker runs it
+async_feature_extraction = True
+
+# faces inserted per transaction by /faces/bulk_upload/
+bulk_upload_chunk_size = 200
+bulk_upload_max_file_size = 20 * 1024 * 1024 # bytes, per archive member
+
+# /commands/enroll/ only queues the command, manage.py run_command_worker runs it
+async_enrollment = True
+# a running command without progress for this long (seconds) is failed, its worker is assumed dead
+command_timeout = 3600
+
+# enrollment feature backfill
+enrollment_pool_min_faces = 256 # use the process pool when at least this many faces miss the feature
+enrollment_processes = None # the number of cpus by default
+enrollment_shard_size = 64 # faces per task
+
 # verification threshold
 openface_NN_H_Threshold = 0.68
 openface_NN_M_Threshold = 0.76
@@ -0,0 +1,136 @@
+from django.test import SimpleTestCase
+# projection
+from .projection import Projection
+# nearest neighbor search
+from .gallery import GalleryIndex
+from .ann import IVFIndex
+# linear svm
+from .classification import LinearSVM, load_svm
+import numpy as np
+import io
+
+
+class ProjectionTest(SimpleTestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.w = random.randn(50, 20)
+        self.mean = random.randn(50, 1)
+        self.X = random.randn(8, 50)
+
+    def test_batch_equals_per_face(self):
+        projection = Projection(self.w, mean=self.mean, k=10)
+        batch = projection.project(self.X)
+        self.assertEqual(batch.shape, (8, 10))
+        for x, feature in zip(self.X, batch):
+            np.testing.assert_allclose(projection.project(x.reshape([1, -1]))[0], feature, rtol=1e-5, atol=1e-5)
+
+    def test_matches_float64(self):
+        projection = Projection(self.w, mean=self.mean)
+        expected = np.dot(self.X - self.mean.reshape([1, -1]), self.w)
+        np.testing.assert_allclose(projection.project(self.X), expected, rtol=1e-4, atol=1e-4)
+
+    def test_without_mean(self):
+        projection = Projection(self.w)
+        self.assertEqual((projection.input_dimension, projection.output_dimension), (50, 20))
+        np.testing.assert_allclose(projection.project(self.X), np.dot(self.X, self.w), rtol=1e-4, atol=1e-4)
+
+
+def brute_force(templates, probe, k):
+    distance = np.linalg.norm(templates - np.reshape(probe, [1, -1]), axis=1)
+    indices = np.argsort(distance, kind='mergesort')[:k]
+    return indices, distance[indices]
+
+
+class GalleryIndexTest(SimpleTestCase):
+    def setUp(self):
+        random = np.random.RandomState(0)
+        self.templates = random.randn(300, 128).astype(np.float32)
+        self.subjects = ['subject%d' % (i) for i in range(300)]
+        self.probes = random.randn(20, 128).astype(np.float32)
+        self.gallery = GalleryIndex(list(self.templates), self.subjects)
+
+    def test_search_equals_brute_force(self):
+        for probe in self.probes:
+            indices, distances = self.gallery.search(probe, 5)
+            expected_indices, expected_distances = brute_force(self.templates, probe, 5)
+            np.testing.assert_array_equal(indices, expected_indices)
+            np.testing.assert_allclose(distances, expected_distances, rtol=1e-4)
+
+    def test_search_batch_equals_search(self):
+        # small chunks to go through several of them
+        indices, distances = self.gallery.search_batch(self.probes, 5, max_elements=300 * 7)
+        self.assertEqual(indices.shape, (20, 5))
+        for probe, probe_indices, probe_distances in zip(self.probes, indices, distances):
+            expected_indices, expected_distances = self.gallery.search(probe, 5)
+            np.testing.assert_array_equal(probe_indices, expected_indices)
+            np.testing.assert_allclose(probe_distances, expected_distances, rtol=1e-4)
+
+    def test_k_larger_than_gallery(self):
+        gallery = GalleryIndex(list(self.templates[:3]), self.subjects[:3])
+        indices, distances = gallery.search_batch(self.probes[:2], 10)
+        self.assertEqual(indices.shape, (2, 3))
+        np.testing.assert_array_equal(indices[0], brute_force(self.templates[:3], self.probes[0], 3)[0])
+
+
+class IVFIndexTest(SimpleTestCase):
+    def setUp(self):
+        random = np.random.RandomState(1)
+        self.templates = random.randn(400, 32).astype(np.float32)
+        self.subjects = np.array(['subject%d' % (i) for i in range(400)])
+        self.probes = random.randn(10, 32).astype(np.float32)
+        self.index = IVFIndex.build(list(self.templates), self.subjects, n_lists=16, iterations=5)
+
+    def test_lists_hold_every_template(self):
+        self.assertEqual(len(self.index), 400)
+        self.assertEqual(self.index.offsets[-1], 400)
+        self.assertEqual(sorted(self.index.subjects), sorted(self.subjects))
+
+    def test_full_nprobe_equals_brute_force(self):
+        for probe in self.probes:
+            subjects, distances = self.index.search(probe, 5, nprobe=self.index.n_lists)
+            expected_indices, expected_distances = brute_force(self.templates, probe, 5)
+            np.testing.assert_array_equal(subjects, self.subjects[expected_indices])
+            np.testing.assert_allclose(distances, expected_distances, rtol=1e-4)
+
+    def test_save_load(self):
+        buffer = io.BytesIO()
+        self.index.save(buffer)
+        buffer.seek(0)
+        loaded = IVFIndex.load(buffer)
+        np.testing.assert_array_equal(loaded.offsets, self.index.offsets)
+        subjects, distances = loaded.search(self.probes[0], 3, nprobe=loaded.n_lists)
+        np.testing.assert_array_equal(subjects, self.index.search(self.probes[0], 3, nprobe=self.index.n_lists)[0])
+
+
+class LinearSVMTest(SimpleTestCase):
+    def setUp(self):
+        random = np.random.RandomState(2)
+        self.X = random.randn(6, 128).astype(np.float32)
+
+    def round_trip(self, svm):
+        buffer = io.BytesIO()
+        svm.save(buffer)
+        buffer.seek(0)
+        # detected as the weight format, not a joblib pickle
+        return load_svm(buffer)
+
+    def test_save_load(self):
+        random = np.random.RandomState(3)
+        svm = LinearSVM(random.randn(4, 128), random.randn(4), np.array(['a', 'b', 'c', 'd']))
+        loaded = self.round_trip(svm)
+        self.assertIsInstance(loaded, LinearSVM)
+        np.testing.assert_array_equal(loaded.classes_, svm.classes_)
+        np.testing.assert_array_equal(loaded.decision_function(self.X), svm.decision_function(self.X))
+        self.assertEqual(loaded.decision_function(self.X).shape, (6, 4))
+
+    def test_decision_function(self):
+        random = np.random.RandomState(4)
+        coef, intercept = random.randn(3, 128), random.randn(3)
+        svm = LinearSVM(coef, intercept, np.array(['a', 'b', 'c']))
+        np.testing.assert_allclose(svm.decision_function(self.X), np.dot(self.X, coef.T) + intercept, rtol=1e-4, atol=1e-4)
+
+    def test_two_classes(self):
+        # a single row of weights, 1-D decisions like SVC
+        random = np.random.RandomState(5)
+        loaded = self.round_trip(LinearSVM(random.randn(1, 128), random.randn(1), np.array(['a', 'b'])))
+        self.assertEqual(loaded.decision_function(self.X).shape, (6,))